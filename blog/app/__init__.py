@@ -1,42 +1,244 @@
 # -*- coding: utf-8 -*-
 import os
+import time
+import asyncio
 import logging
 import json
+import hashlib
 import jinja2
 import aiohttp_jinja2
 from os import environ as env
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from tinydb.storages import MemoryStorage
 from tinydb import TinyDB
 from aiohttp import web
 from .app import json_response
+from .storage import LogDB
+from .comments import CommentIndex
+from .writer import WriteBehindQueue
+from .watcher import PostWatcher
+from .follower import DatabaseFollower
+from .dates import format_date
+from .posts import PostCatalog, render_cache_config
+from .render_cache import RenderCache
+from .snapshot import SnapshotStore
+from .search import SearchIndex
+from .ratelimit import create_rate_limiters
+from .duplicates import DuplicateIndex
+from .page_cache import PageCache, page_cache_middleware_factory
+from .conditional import (
+    conditional_middleware_factory, directory_digest, file_version,
+    static_url_factory)
+from .compression import (
+    compression_middleware_factory, static_compression_middleware_factory,
+    precompressed_files)
 from .views import (
     handle_index, handle_page, handle_contact, handle_contact_form,
-    handle_about, handle_blog_post, handle_blog_post_comment
+    handle_about, handle_blog_post, handle_blog_post_comment, PAGE_SIZE,
+    handle_post_comments, handle_search, handle_tag, handle_author,
+    invalidate_post_pages
 )
 
 
 async def connect_tinydb_db(app):
-    if app['config'].memory_db:
+    config = app['config']
+    if config.memory_db:
         app.db = TinyDB(storage=MemoryStorage)
+    elif config.db_backend == 'log':
+        # existing TinyDB database is imported on the first run
+        app.db = LogDB(
+            config.log_db_name, import_path=config.db_name,
+            read_only=config.db_read_only)
+    elif config.db_read_only:
+        app.db = TinyDB(config.db_name, access_mode='r')
     else:
-        db_name = app['config'].db_name
-        app.db = TinyDB(db_name)
+        app.db = TinyDB(config.db_name)
+    # the database is not thread safe, it is used by one thread at a time
+    app.db_executor = ThreadPoolExecutor(1)
+
+    app.writer = WriteBehindQueue(
+        app.db, max_batch=config.write_batch_size,
+        max_delay=config.write_batch_delay,
+        stats_interval=config.write_stats_interval,
+        executor=app.db_executor)
+    app.writer.start()
 
     return app.db
 
 
+def load_comments(app):
+    start = time.monotonic()
+    app.comments = CommentIndex.build(app.db)
+    logger.info(
+        'Indexed %d comments in %.3fs', len(app.comments),
+        time.monotonic() - start)
+
+    return app.comments
+
+
+def start_db_follower(app):
+    config = app['config']
+    app.db_follower = None
+    if not config.memory_db and config.db_refresh_interval:
+        app.db_follower = DatabaseFollower(
+            app, path=config.db_name, interval=config.db_refresh_interval,
+            executor=app.db_executor)
+        app.db_follower.start()
+
+    return app.db_follower
+
+
+async def stop_db_follower(app):
+    if app.db_follower is not None:
+        await app.db_follower.stop()
+
+
+def load_duplicates(app):
+    config = app['config']
+    app.duplicates = None
+    if config.duplicate_window:
+        start = time.monotonic()
+        app.duplicates = DuplicateIndex.build(
+            app.db, config.duplicate_window, config.duplicate_max_size)
+        logger.info(
+            'Indexed %d recent submissions in %.3fs', len(app.duplicates),
+            time.monotonic() - start)
+
+    return app.duplicates
+
+
 async def disconnect_tinydb_db(app):
-    pass
+    await app.writer.close()
+    logger.info('Written %d documents', app.writer.written)
+    app.db_executor.shutdown()
+    app.db.close()
+
+
+async def load_posts(app):
+    config = app['config']
+    render_cache = None
+    if config.render_cache_path:
+        render_cache = RenderCache(
+            config.render_cache_path, config.render_cache_size,
+            config=render_cache_config())
+
+    snapshots = None
+    if config.snapshot_path:
+        snapshots = SnapshotStore(
+            config.snapshot_path, render_cache=render_cache)
+
+    start = time.monotonic()
+    app.posts = PostCatalog(
+        config.posts_path, page_size=PAGE_SIZE, render_cache=render_cache,
+        snapshots=snapshots)
+    app.search = SearchIndex()
+    app.posts.listeners.append(lambda slugs: update_search(app, slugs))
+    app.posts.listeners.append(
+        lambda slugs: invalidate_post_pages(app, slugs))
+    index = await app.posts.get_index(app.executor)
+    logger.info(
+        'Loaded %d posts in %.3fs', len(index.posts), time.monotonic() - start)
+
+    start = time.monotonic()
+    await refresh_search(app)
+    logger.info(
+        'Indexed %d posts for search in %.3fs', len(app.search),
+        time.monotonic() - start)
+
+    return app.posts
+
+
+async def refresh_search(app):
+    try:
+        await app.search.refresh(app.posts, app.executor)
+    except Exception:
+        logger.exception('Cannot index posts for search')
+
+
+def update_search(app, slugs):
+    """Index changed posts in the background, not on the next search"""
+    app.search.invalidate(slugs)
+    asyncio.ensure_future(refresh_search(app))
+
+
+def start_post_watcher(app):
+    config = app['config']
+    app.post_watcher = None
+    if config.posts_watch != 'off':
+        app.post_watcher = PostWatcher(
+            app.posts, executor=app.executor, mode=config.posts_watch,
+            interval=config.posts_poll_interval)
+        app.post_watcher.start()
+
+    return app.post_watcher
+
+
+async def stop_post_watcher(app):
+    if app.post_watcher is not None:
+        await app.post_watcher.stop()
+
+
+async def prerender_posts(app):
+    workers = app['config'].prerender_workers
+    if not workers:
+        return
+
+    start = time.monotonic()
+    with ProcessPoolExecutor(workers) as executor:
+        rendered, failed = await app.posts.prerender(executor)
+    logger.info(
+        'Pre-rendered %d posts (%d failed) in %.3fs using %d processes',
+        rendered, failed, time.monotonic() - start, workers)
+
+
+def create_executor(app):
+    config = app['config']
+    if config.executor == 'process':
+        app.executor = ProcessPoolExecutor(config.executor_workers)
+    elif config.executor == 'thread':
+        app.executor = ThreadPoolExecutor(config.executor_workers)
+    else:
+        app.executor = None
+
+    return app.executor
+
+
+def shutdown_executor(app):
+    if app.executor is not None:
+        app.executor.shutdown()
+
+
+def create_page_cache(app):
+    size = app['config'].page_cache_size
+    app.page_cache = PageCache(size) if size else None
+
+    return app.page_cache
 
 
 async def on_startup(app):
+    create_executor(app)
+    create_page_cache(app)
+    create_rate_limiters(app)
+    app.static_variants = precompressed_files(app.static_path)
+    load_pages_version(app)
+    warm_up_templates(app)
     await connect_tinydb_db(app)
+    load_comments(app)
+    load_duplicates(app)
+    await load_posts(app)
+    await prerender_posts(app)
+    start_post_watcher(app)
+    start_db_follower(app)
 
 
 async def on_shutdown(app):
+    await stop_post_watcher(app)
+    await stop_db_follower(app)
     await disconnect_tinydb_db(app)
+    # pending refresh of the search index uses the executor
+    await refresh_search(app)
+    shutdown_executor(app)
 
 
 def setup_routers(app):
@@ -46,6 +248,12 @@ def setup_routers(app):
     app.router.add_post('/contact', handle_contact_form)
     app.router.add_get('/about', handle_about)
     app.router.add_get('/post/{slug}', handle_blog_post)
+    app.router.add_get('/post/{slug}/comments', handle_post_comments)
+    app.router.add_get('/search', handle_search)
+    app.router.add_get('/tag/{tag}', handle_tag)
+    app.router.add_get('/tag/{tag}/page/{page:\d+}', handle_tag)
+    app.router.add_get('/author/{author}', handle_author)
+    app.router.add_get('/author/{author}/page/{page:\d+}', handle_author)
     app.router.add_post('/comment', handle_blog_post_comment)
 
 
@@ -56,6 +264,70 @@ class BaseConfig(object):
 
     db_name = env.get('TINYDB_DB_NAME', 'tinydb.json')
     memory_db = False
+    # the database is only read, comments and contacts cannot be sent
+    db_read_only = False
+    # search form in the navigation bar, /search needs the application
+    search_form = True
+    # log: append-only file with one JSON line per change, tinydb: TinyDB
+    db_backend = env.get('DB_BACKEND', 'log')
+    log_db_name = env.get('LOG_DB_NAME', 'db.jsonl')
+    # comments and contacts are written in batches of that size, or after
+    # that many seconds
+    write_batch_size = int(env.get('WRITE_BATCH_SIZE', 100))
+    write_batch_delay = float(env.get('WRITE_BATCH_DELAY', 0.5))
+    # depth of that queue is logged every that many seconds, 0 disables it
+    write_stats_interval = float(env.get('WRITE_STATS_INTERVAL', 60))
+    # comments written by other workers are shown after at most that many
+    # seconds, 0 disables it (a single worker)
+    db_refresh_interval = float(env.get('DB_REFRESH_INTERVAL', 1))
+    posts_path = env.get('POSTS_PATH', os.path.join(
+        os.path.dirname(__file__), '..', 'posts'))
+    # how changes of posts are found: auto (inotify if available, otherwise
+    # polling), inotify, poll, or off (check the directory on every request)
+    posts_watch = env.get('POSTS_WATCH', 'auto')
+    posts_poll_interval = float(env.get('POSTS_POLL_INTERVAL', 2))
+    # templates compiled by compile_templates.py and directory for bytecode
+    # cache of templates, empty disables them
+    templates_compiled_path = env.get('TEMPLATES_COMPILED_PATH', '')
+    templates_cache_path = env.get('TEMPLATES_CACHE_PATH', '')
+    # where blocking file and markdown work runs: thread, process or none
+    # (directly on the event loop)
+    executor = env.get('EXECUTOR', 'thread')
+    executor_workers = int(env.get('EXECUTOR_WORKERS', 4))
+    # render all posts at startup in that many processes, 0 disables it
+    prerender_workers = int(env.get('PRERENDER_WORKERS', 0))
+    # directory with rendered posts shared by workers, empty disables it
+    render_cache_path = env.get('RENDER_CACHE_PATH', '')
+    render_cache_size = int(env.get('RENDER_CACHE_SIZE', 64 * 1024 * 1024))
+    # directory with memory mapped snapshot of rendered posts shared by
+    # workers, empty disables it
+    snapshot_path = env.get('SNAPSHOT_PATH', '')
+    # in-memory cache of rendered pages in bytes, 0 disables it
+    page_cache_size = int(env.get('PAGE_CACHE_SIZE', 16 * 1024 * 1024))
+    # pages and JSON responses of at least that many bytes are compressed,
+    # 0 disables it
+    compress_min_size = int(env.get('COMPRESS_MIN_SIZE', 1024))
+    # comments shown on one page of a post, 0 shows all of them
+    comments_page_size = int(env.get('COMMENTS_PAGE_SIZE', 50))
+    # post pages with that many comments, or a full page of them, are
+    # streamed to the client instead of rendered in memory first, the page
+    # cache serves them afterwards, 0 disables streaming
+    stream_min_comments = int(env.get('STREAM_MIN_COMMENTS', 50))
+    # POST /comment and /contact per client IP: requests per second after
+    # a burst of that many, 0 disables it
+    rate_limit_client = float(env.get('RATE_LIMIT_CLIENT', 0.1))
+    rate_limit_client_burst = int(env.get('RATE_LIMIT_CLIENT_BURST', 5))
+    # comments per second of all clients to one post, after a burst
+    rate_limit_post = float(env.get('RATE_LIMIT_POST', 0.5))
+    rate_limit_post_burst = int(env.get('RATE_LIMIT_POST_BURST', 20))
+    # clients and posts tracked by rate limits, least recently seen are
+    # forgotten
+    rate_limit_keys = int(env.get('RATE_LIMIT_KEYS', 10000))
+    # copies of a comment or contact message sent again within that many
+    # seconds are dropped, 0 disables it
+    duplicate_window = int(env.get('DUPLICATE_WINDOW', 24 * 60 * 60))
+    # submissions remembered to find copies, the oldest are forgotten
+    duplicate_max_size = int(env.get('DUPLICATE_MAX_SIZE', 100000))
 
 
 class MainConfig(BaseConfig):
@@ -67,6 +339,10 @@ class TestConfig(BaseConfig):
     test = True
     debug = True
     memory_db = True
+    posts_watch = 'off'
+    rate_limit_client = 0
+    rate_limit_post = 0
+    duplicate_window = 0
 
 
 logger = logging.getLogger(__name__)
@@ -87,6 +363,10 @@ def render_template(template_name, request, context, *,
     return response
 
 
+# headers of HTTP errors still sent with the rendered error page
+KEPT_ERROR_HEADERS = ('Allow', 'Location', 'Retry-After')
+
+
 async def error_middleware_factory(app, handler):
     async def error_middleware(request):
         try:
@@ -95,6 +375,9 @@ async def error_middleware_factory(app, handler):
             context = {'error': ex.reason, 'status': ex.status}
             response = render_template(
                 'error.jinja2', request, context, status=ex.status)
+            for name in KEPT_ERROR_HEADERS:
+                if name in ex.headers:
+                    response.headers[name] = ex.headers[name]
             return response
         except Exception as ex:
             logger.exception('Internal server error')
@@ -107,17 +390,98 @@ async def error_middleware_factory(app, handler):
     return error_middleware
 
 
-def format_date(x, format_):
-    obj = datetime.strptime(x, '%Y-%m-%dT%H:%M:%S')
-    return datetime.strftime(obj, format_)
+TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), '..', 'templates')
+TEMPLATE_FILTERS = {
+    'format_date': format_date
+}
+
+
+def template_environment(loader, **kwargs):
+    """
+    Jinja environment of the application, compile_templates.py uses it
+    too, so compiled templates escape values the same way
+    """
+    env = jinja2.Environment(loader=loader, autoescape=True, **kwargs)
+    env.filters.update(TEMPLATE_FILTERS)
+    return env
+
+
+def template_loader(conf):
+    loader = jinja2.FileSystemLoader(TEMPLATES_PATH)
+    if conf.templates_compiled_path:
+        # templates compiled ahead of time by compile_templates.py
+        loader = jinja2.ChoiceLoader([
+            jinja2.ModuleLoader(conf.templates_compiled_path), loader])
+    return loader
+
+
+def pages_version(static_path):
+    """
+    Version of what changes pages besides posts and comments: templates,
+    static files linked from them and the markdown renderer. It is part of
+    entity tags, so clients do not keep old markup after a deploy.
+    """
+    digest = hashlib.sha1(directory_digest(TEMPLATES_PATH).encode('utf-8'))
+    digest.update(
+        directory_digest(static_path, stat_only=True).encode('utf-8'))
+    digest.update(render_cache_config().encode('utf-8'))
+    return digest.hexdigest()[:10]
+
+
+def load_pages_version(app):
+    # cheap to compare, to notice changes in debug mode
+    app.pages_stamp = (
+        directory_digest(TEMPLATES_PATH, stat_only=True),
+        directory_digest(app.static_path, stat_only=True))
+    app.pages_version = pages_version(app.static_path)
+
+
+async def reload_middleware_factory(app, handler):
+    """
+    Debug mode: templates are reloaded on change, so versions of pages and
+    static files and the cached pages are dropped when files change
+    """
+    async def reload_middleware(request):
+        app = request.app
+        stamp = (
+            directory_digest(TEMPLATES_PATH, stat_only=True),
+            directory_digest(app.static_path, stat_only=True))
+        if stamp != app.pages_stamp:
+            logger.info('Templates or static files changed')
+            file_version.cache_clear()
+            load_pages_version(app)
+            if app.page_cache is not None:
+                app.page_cache.clear()
+        return await handler(request)
+
+    return reload_middleware
+
+
+def warm_up_templates(app):
+    """Compile all templates, so first requests do not pay for it"""
+    start = time.monotonic()
+    env = aiohttp_jinja2.get_env(app)
+    # compiled templates cannot be listed, so names come from the sources
+    names = [x for x in jinja2.FileSystemLoader(TEMPLATES_PATH)
+             .list_templates() if x.endswith('.jinja2')]
+    for name in names:
+        env.get_template(name)
+    logger.info(
+        'Loaded %d templates in %.3fs', len(names), time.monotonic() - start)
 
 
 def create(loop, conf=None):
     if conf is None:
         conf = MainConfig
 
+    middlewares = [
+        error_middleware_factory, compression_middleware_factory,
+        page_cache_middleware_factory, conditional_middleware_factory,
+        static_compression_middleware_factory]
+    if conf.debug:
+        middlewares.insert(0, reload_middleware_factory)
     app = web.Application(
-        loop=loop, middlewares=[error_middleware_factory], debug=conf.debug)
+        loop=loop, debug=conf.debug, middlewares=middlewares)
     app.config = conf
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
@@ -125,13 +489,21 @@ def create(loop, conf=None):
     static_path = os.path.join(
         os.path.dirname(__file__), '..', 'static')
     app.router.add_static('/static', static_path)
-
-    templates_path = os.path.join(
-        os.path.dirname(__file__), '..', 'templates')
-    aiohttp_jinja2.setup(
-        app, loader=jinja2.FileSystemLoader(templates_path), filters={
-            'format_date': format_date
-        })
+    app.static_path = static_path
+
+    bytecode_cache = None
+    if conf.templates_cache_path:
+        os.makedirs(conf.templates_cache_path, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(
+            conf.templates_cache_path)
+
+    # without auto reload templates are not checked for changes on disk
+    env = template_environment(
+        template_loader(conf), bytecode_cache=bytecode_cache,
+        auto_reload=conf.debug)
+    env.globals['app'] = app
+    env.globals['static_url'] = static_url_factory('/static', static_path)
+    app[aiohttp_jinja2.APP_KEY] = env
 
     conf.setup(app)
     setup_routers(app)
@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
+import aiohttp_jinja2
 
 from aiohttp import web
 from datetime import datetime
+from .compression import add_vary
+from .conditional import VALIDATORS_KEY, validator_headers
 
 
 logger = logging.getLogger(__name__)
 
 
+# body of a fully streamed response, so it can be kept in the page cache
+STREAMED_BODY_KEY = 'streamed_body'
+
+
 def json_response(data, *args, **kwargs):
     def _serialize_data(data):
         if isinstance(data, list):
@@ -25,6 +33,71 @@ def json_response(data, *args, **kwargs):
         *args, **kwargs)
 
 
+async def stream_template(template_name, request, context, *,
+                          encoding='utf-8', chunk_size=16 * 1024,
+                          compress=False):
+    """
+    Render the template into a chunked response piece by piece, instead of
+    building the whole page in memory first. Errors in the first chunk are
+    raised as usual, later ones can only break the connection. The sent
+    body is kept in the response under `STREAMED_BODY_KEY`.
+    """
+    env = aiohttp_jinja2.get_env(request.app)
+    context = dict(
+        request.get(aiohttp_jinja2.REQUEST_CONTEXT_KEY, {}), **context)
+    chunks = env.get_template(template_name).generate(context)
+
+    def next_chunk():
+        buffer, size = [], 0
+        for part in chunks:
+            buffer.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                break
+        return ''.join(buffer).encode(encoding)
+
+    chunk = next_chunk()
+    response = web.StreamResponse()
+    response.content_type = 'text/html'
+    response.charset = encoding
+    # headers cannot be changed by middlewares once the response is sent
+    validators = request.get(VALIDATORS_KEY)
+    if validators is not None:
+        response.headers.update(validator_headers(*validators))
+    if compress:
+        # compressed on the fly, if the client accepts it
+        response.enable_compression()
+        add_vary(response)
+    await response.prepare(request)
+
+    sent = []
+    while chunk:
+        await response.write(chunk)
+        sent.append(chunk)
+        try:
+            chunk = next_chunk()
+        except Exception:
+            logger.exception('Cannot render %s', template_name)
+            # do not finish the response, so the client sees it is broken
+            response.force_close()
+            request.transport.close()
+            return response
+
+    await response.write_eof()
+    response[STREAMED_BODY_KEY] = b''.join(sent)
+    return response
+
+
+async def run_in_executor(executor, fun, *args):
+    """
+    Run blocking `fun` in the executor, or directly when it is None
+    """
+    if executor is None:
+        return fun(*args)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, fun, *args)
+
+
 def is_int(element):
     try:
         int(element)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import sys
+import logging
+
+from collections import defaultdict
+from tinydb import Query
+from .dates import Timestamp
+from .views import from_tinydb
+
+
+logger = logging.getLogger(__name__)
+
+
+class CommentIndex(object):
+    """
+    Comments grouped by post slug in order of insertion. Built from the
+    database once and then kept up to date by adding inserted comments,
+    so showing a post does not scan the whole database.
+
+    Comments are only appended, so position of a comment in its post is
+    a stable cursor for paging from the newest comments to older ones.
+    """
+
+    def __init__(self):
+        self._by_slug = defaultdict(list)
+
+    @classmethod
+    def build(cls, db):
+        index = cls()
+        for doc in db.search(Query().type == 'comment'):
+            index.add(from_tinydb(doc))
+        return index
+
+    def add(self, comment):
+        comment = comment._replace(
+            date=Timestamp(comment.date), author=sys.intern(comment.author),
+            post_slug=sys.intern(comment.post_slug))
+        self._by_slug[comment.post_slug].append(comment)
+
+    def get(self, slug):
+        return self._by_slug.get(slug, [])
+
+    def page(self, slug, limit, before=None):
+        """
+        Up to `limit` (all when 0) comments before the cursor, newest first,
+        and the cursor of older comments or None if there are no more
+        """
+        comments = self.get(slug)
+        end = len(comments) if before is None else min(before, len(comments))
+        start = max(0, end - limit) if limit else 0
+        return comments[start:end][::-1], start or None
+
+    def __len__(self):
+        return sum(len(x) for x in self._by_slug.values())
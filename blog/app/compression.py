@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import os
+import gzip
+import logging
+import mimetypes
+
+from functools import wraps
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# in order of preference
+STATIC_ENCODINGS = ('br', 'gzip')
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+
+COMPRESSIBLE_TYPES = (
+    'application/javascript', 'application/json', 'image/svg+xml')
+COMPRESSIBLE_EXTENSIONS = (
+    '.css', '.js', '.map', '.svg', '.html', '.txt', '.json', '.eot', '.ttf',
+    '.otf')
+
+
+def is_compressible(content_type):
+    return content_type.startswith('text/') or content_type in (
+        COMPRESSIBLE_TYPES)
+
+
+def compress(data, encoding, *, best=False):
+    """Compress fast for responses, or as small as possible (`best`)"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 4)
+    # no timestamp in the header, so the output is reproducible
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+def accepted_encoding(request, available):
+    """Best of `available` encodings accepted by the client, or None"""
+    accepted = {}
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    def quality(encoding):
+        return accepted.get(encoding, accepted.get('*', 0.0))
+
+    candidates = [x for x in available if quality(x) > 0]
+    # the first one wins a tie, so server preference is kept
+    return max(candidates, key=quality, default=None)
+
+
+def compressed_variants(body, content_type, min_size):
+    """Compressed versions of the body by encoding, if worth it"""
+    if not min_size or len(body) < min_size or not is_compressible(
+            content_type):
+        return {}
+    return {x: compress(body, x) for x in ENCODINGS}
+
+
+def add_vary(response):
+    vary = response.headers.get('Vary')
+    if vary is None:
+        response.headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        response.headers['Vary'] = vary + ', Accept-Encoding'
+
+
+def compress_file(path, encodings=STATIC_ENCODINGS):
+    """
+    Write compressed copies next to the file, unless they are up to date
+    or do not save anything. Return the written paths.
+    """
+    written = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    mtime = os.stat(path).st_mtime
+
+    for encoding in encodings:
+        if encoding == 'br' and brotli is None:
+            logger.warning('brotli is not installed, skipping .br files')
+            continue
+        target = path + EXTENSIONS[encoding]
+        if os.path.exists(target) and os.stat(target).st_mtime >= mtime:
+            continue
+
+        compressed = compress(data, encoding, best=True)
+        if len(compressed) >= len(data):
+            continue
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        written.append(target)
+    return written
+
+
+# directories in static which are not served, e.g. packages of npm install
+SKIPPED_DIRECTORIES = {'node_modules'}
+
+
+def walk_static(path):
+    """os.walk over the static directory, without SKIPPED_DIRECTORIES"""
+    for root, dirs, names in os.walk(path):
+        dirs[:] = sorted(x for x in dirs if x not in SKIPPED_DIRECTORIES)
+        yield root, dirs, names
+
+
+def compress_directory(path, min_size=1024):
+    written = []
+    for root, _, names in walk_static(path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            if (name.endswith(COMPRESSIBLE_EXTENSIONS) and
+                    os.path.getsize(file_path) >= min_size):
+                written.extend(compress_file(file_path))
+    return written
+
+
+def precompressed_files(static_path):
+    """
+    Compressed copies of static files found by compress_static.py:
+    path relative to the static directory -> {encoding: path of the copy}.
+    Built once at startup, requests only look names up in it, so neither
+    a name sent by a client nor `..` in it can reach the file system.
+    """
+    ret = {}
+    for root, _, names in walk_static(static_path):
+        names = set(names)
+        for name in names:
+            variants = {
+                encoding: os.path.join(root, name + extension)
+                for encoding, extension in EXTENSIONS.items()
+                if name + extension in names}
+            if variants:
+                relative = os.path.relpath(
+                    os.path.join(root, name), static_path)
+                ret[relative.replace(os.sep, '/')] = variants
+    return ret
+
+
+async def static_compression_middleware_factory(app, handler):
+    """
+    Serve files compressed by compress_static.py instead of static files,
+    so they are not compressed on every request
+    """
+    @wraps(handler)
+    async def static_compression_middleware(request):
+        file_name = request.match_info.get('filename')
+        if (file_name is None or request.method not in ('GET', 'HEAD') or
+                not request.path.startswith('/static/')):
+            return await handler(request)
+
+        variants = app.static_variants.get(file_name, {})
+        encoding = accepted_encoding(
+            request, [x for x in STATIC_ENCODINGS if x in variants])
+        if encoding is None:
+            response = await handler(request)
+            if variants:
+                add_vary(response)
+            return response
+
+        content_type, _ = mimetypes.guess_type(file_name)
+        return web.FileResponse(variants[encoding], headers={
+            'Content-Type': content_type or 'application/octet-stream',
+            'Content-Encoding': encoding,
+            'Vary': 'Accept-Encoding',
+        })
+
+    return static_compression_middleware
+
+
+async def compression_middleware_factory(app, handler):
+    """Compress rendered pages, unless they are compressed already"""
+    async def compression_middleware(request):
+        response = await handler(request)
+
+        min_size = request.app.config.compress_min_size
+        if (not min_size or type(response) is not web.Response or
+                response.status != 200 or
+                'Content-Encoding' in response.headers or
+                not isinstance(response.body, bytes) or
+                len(response.body) < min_size or
+                not is_compressible(response.content_type)):
+            return response
+
+        add_vary(response)
+        encoding = accepted_encoding(request, ENCODINGS)
+        if encoding is not None:
+            response.body = compress(response.body, encoding)
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    return compression_middleware
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import logging
+
+from functools import lru_cache, wraps
+from email.utils import formatdate, parsedate_to_datetime
+from aiohttp import web
+from .compression import walk_static
+
+
+logger = logging.getLogger(__name__)
+
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+VALIDATORS_KEY = 'validators'
+
+
+def make_etag(*parts):
+    """
+    Weak entity tag, pages are equivalent but not byte-for-byte the same
+    when they are compressed
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return 'W/"{}"'.format(digest.hexdigest())
+
+
+def opaque_tag(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def format_http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def etag_matches(etag, if_none_match):
+    if if_none_match.strip() == '*':
+        return True
+    # weak comparison is used for GET requests
+    tags = [opaque_tag(x.strip()) for x in if_none_match.split(',')]
+    return opaque_tag(etag) in tags
+
+
+def is_not_modified(request, etag=None, last_modified=None):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag is not None and etag_matches(etag, if_none_match)
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since is not None and last_modified is not None:
+        since = parse_http_date(if_modified_since)
+        # HTTP dates have precision of one second
+        return since is not None and int(last_modified) <= since
+
+    return False
+
+
+def validator_headers(etag=None, last_modified=None):
+    headers = {}
+    if etag is not None:
+        headers['ETag'] = etag
+    if last_modified is not None:
+        headers['Last-Modified'] = format_http_date(last_modified)
+    return headers
+
+
+def not_modified_response(etag=None, last_modified=None):
+    return web.Response(
+        status=304, headers=validator_headers(etag, last_modified))
+
+
+def conditional_response(request, *, etag=None, last_modified=None):
+    """
+    Return 304 response if the client has current version of the page,
+    otherwise remember validators, so they are sent with the response.
+    """
+    if request.method in ('GET', 'HEAD') and is_not_modified(
+            request, etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    request[VALIDATORS_KEY] = (etag, last_modified)
+    return None
+
+
+@lru_cache(maxsize=None)
+def file_version(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:10]
+    except OSError:
+        logger.warning('Missing static file %s', file_path)
+        return None
+
+
+def directory_digest(path, *, stat_only=False):
+    """
+    Hash of names and contents of files in the directory, or of their sizes
+    and modification times only with `stat_only`; node_modules and such
+    are skipped as in static files
+    """
+    digest = hashlib.sha1()
+    for root, _, names in walk_static(path):
+        for name in sorted(names):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+            if stat_only:
+                stat = os.stat(file_path)
+                digest.update('{} {}'.format(
+                    stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+                continue
+            with open(file_path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def static_url_factory(prefix, static_path):
+    """
+    Jinja global returning url of a static file with version of its
+    content, so it can be cached by browsers forever
+    """
+    def static_url(file_name):
+        url = '{}/{}'.format(prefix, file_name)
+        version = file_version(os.path.join(static_path, file_name))
+        if version is None:
+            return url
+        return '{}?v={}'.format(url, version)
+
+    return static_url
+
+
+async def conditional_middleware_factory(app, handler):
+    # keep attributes like `cache_page` visible for outer middlewares
+    @wraps(handler)
+    async def conditional_middleware(request):
+        response = await handler(request)
+
+        validators = request.get(VALIDATORS_KEY)
+        if validators is not None and response.status == 200:
+            response.headers.update(validator_headers(*validators))
+
+        if (request.path.startswith('/static/') and
+                'v' in request.query and response.status == 200):
+            response.headers['Cache-Control'] = (
+                'public, max-age={}, immutable'.format(STATIC_MAX_AGE))
+
+        return response
+
+    return conditional_middleware
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+DISPLAY_FORMAT = '%d.%m.%Y %H:%M'
+
+
+class Timestamp(object):
+    """
+    Date of a post or comment as stored in files and the database, parsed
+    once when the object is created. It is formatted for display once as
+    well, so templates do not format the same date on every render. It
+    compares and hashes as the stored string.
+    """
+
+    __slots__ = ('value', 'timestamp', '_display')
+
+    def __new__(cls, value):
+        if isinstance(value, Timestamp):
+            return value
+
+        obj = super().__new__(cls)
+        date = datetime.strptime(value, DATE_FORMAT)
+        obj.value = value
+        obj.timestamp = date.timestamp()
+        obj._display = date.strftime(DISPLAY_FORMAT)
+        return obj
+
+    @property
+    def datetime(self):
+        return datetime.strptime(self.value, DATE_FORMAT)
+
+    def strftime(self, format_):
+        if format_ == DISPLAY_FORMAT:
+            return self._display
+        return self.datetime.strftime(format_)
+
+    def __reduce__(self):
+        return Timestamp, (self.value,)
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return 'Timestamp({!r})'.format(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, Timestamp):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+def format_date(value, format_):
+    """Jinja filter, plain strings are parsed on every call"""
+    return Timestamp(value).strftime(format_)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import hashlib
+import logging
+
+from collections import OrderedDict
+from tinydb import Query
+from .dates import Timestamp
+
+
+logger = logging.getLogger(__name__)
+
+
+def submission_key(type_, *fields):
+    """Hash of the submitted content, surrounding whitespace is ignored"""
+    data = json.dumps([type_] + [x.strip() for x in fields])
+    return hashlib.sha1(data.encode('utf-8')).digest()
+
+
+def comment_key(slug, email, message):
+    return submission_key('comment', slug, email.lower(), message)
+
+
+def contact_key(email, message):
+    return submission_key('contact', email.lower(), message)
+
+
+# stored document -> its key
+DOCUMENT_KEYS = {
+    'comment': lambda x: comment_key(x['post_slug'], x['email'], x['content']),
+    'contact': lambda x: contact_key(x['email'], x['message']),
+}
+
+
+class DuplicateIndex(object):
+    """
+    Hashes of comments and contact messages sent in the last `window`
+    seconds, oldest first, so a copy sent again (double click, replaying
+    bot) is found without looking into the database. At most `max_size`
+    of them are kept, the oldest are forgotten first.
+    """
+
+    def __init__(self, window, max_size, *, clock=time.time):
+        self.window = window
+        self.max_size = max_size
+        self.clock = clock
+        self._seen = OrderedDict()  # key -> timestamp of the submission
+
+    @classmethod
+    def build(cls, db, window, max_size, **kwargs):
+        """Index of submissions stored in the database within the window"""
+        index = cls(window, max_size, **kwargs)
+        start = index.clock() - window
+        recent = []
+        for doc in db.search(Query().type.one_of(list(DOCUMENT_KEYS))):
+            try:
+                timestamp = Timestamp(doc['date']).timestamp
+                if timestamp >= start:
+                    recent.append((timestamp, DOCUMENT_KEYS[doc['type']](doc)))
+            except (KeyError, ValueError, AttributeError):
+                logger.warning('Skipping broken document %r', doc)
+
+        for timestamp, key in sorted(recent):
+            index.add(key, timestamp)
+        return index
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _expire(self):
+        start = self.clock() - self.window
+        while self._seen:
+            key, timestamp = next(iter(self._seen.items()))
+            if timestamp >= start and len(self._seen) <= self.max_size:
+                break
+            del self._seen[key]
+
+    def __contains__(self, key):
+        self._expire()
+        return key in self._seen
+
+    def add(self, key, timestamp=None):
+        if key in self._seen:
+            return
+        self._seen[key] = self.clock() if timestamp is None else timestamp
+        self._expire()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import asyncio
+import logging
+import tempfile
+
+from urllib.parse import quote, unquote
+from .app import run_in_executor
+
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_NAME = '.export.json'
+
+
+def page_file(url):
+    """
+    Path of the file with the page, relative to the output directory.
+    ValueError is raised for a url which cannot be a path in it: a tag or
+    an author with `/` would escape the directory or collide with another
+    page.
+    """
+    parts = [unquote(x) for x in url.strip('/').split('/') if x]
+    if any('/' in x or x in ('.', '..') or '\0' in x for x in parts):
+        raise ValueError('Cannot export {}'.format(url))
+    return os.path.join(*parts, 'index.html')
+
+
+def write_page(file_path, body):
+    """Replace the file atomically, unless it has the same content already"""
+    try:
+        with open(file_path, 'rb') as f:
+            if f.read() == body:
+                return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def remove_page(file_path):
+    try:
+        os.remove(file_path)
+        os.removedirs(os.path.dirname(file_path))
+    except OSError:  # directory is not empty
+        pass
+
+
+async def site_urls(app):
+    """Urls of all pages served by GET requests"""
+    index = await app.posts.get_index(app.executor)
+    urls = ['/', '/about', '/contact']
+    urls.extend('/page/{}'.format(x + 1) for x in range(index.total_pages))
+    urls.extend('/post/{}'.format(x.slug) for x in index.posts)
+    for prefix, listings in (('/tag/', index.tags),
+                             ('/author/', index.authors)):
+        for key, pages in sorted(listings.items()):
+            url = prefix + quote(key, safe='')
+            urls.append(url)
+            urls.extend(
+                '{}/page/{}'.format(url, x + 1) for x in range(len(pages)))
+    return urls
+
+
+class SiteExport(object):
+    """
+    Writes pages of the blog into a directory, so they can be served by
+    any static file server. Entity tags of written pages are kept in the
+    directory, pages which did not change since the previous export are
+    answered with 304 and are not rendered again. A change of templates
+    renders everything.
+    """
+
+    def __init__(self, client, output, *, fingerprint='', executor=None,
+                 concurrency=4):
+        self.client = client
+        self.output = output
+        self.fingerprint = fingerprint
+        self.executor = executor
+        self.concurrency = concurrency
+        self.etags = {}  # url -> entity tag of the written page or None
+
+    def _manifest_path(self):
+        return os.path.join(self.output, MANIFEST_NAME)
+
+    def _load_manifest(self):
+        """Entity tags of pages written by the previous export"""
+        try:
+            with open(self._manifest_path(), encoding='utf-8') as f:
+                manifest = json.load(f)
+            pages = dict(manifest['pages'])
+        except FileNotFoundError:
+            return {}
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Broken export manifest, exporting all pages')
+            return {}
+
+        if manifest.get('fingerprint') != self.fingerprint:
+            # pages are rendered again, but removed ones are still known
+            return dict.fromkeys(pages)
+        return pages
+
+    def _save_manifest(self):
+        data = json.dumps(
+            {'fingerprint': self.fingerprint, 'pages': self.etags},
+            indent=2, sort_keys=True)
+        write_page(self._manifest_path(), data.encode('utf-8'))
+
+    async def export_page(self, url, old_etag=None):
+        """Return True if the file of the page was written"""
+        try:
+            file_path = os.path.join(self.output, page_file(url))
+        except ValueError:
+            logger.warning('Skipping page %s, it cannot be a file', url)
+            return False
+        headers = {'Accept-Encoding': 'identity'}
+        if old_etag is not None and os.path.exists(file_path):
+            headers['If-None-Match'] = old_etag
+
+        resp = await self.client.get(url, headers=headers)
+        body = await resp.read()
+        if resp.status == 304:
+            self.etags[url] = old_etag
+            return False
+        if resp.status != 200:
+            raise RuntimeError('Cannot export {}, status {}'.format(
+                url, resp.status))
+
+        written = await run_in_executor(
+            self.executor, write_page, file_path, body)
+        self.etags[url] = resp.headers.get('ETag')
+        return written
+
+    async def export(self, urls):
+        """Export the pages, return counts of written and removed pages"""
+        old_etags = self._load_manifest()
+        self.etags = {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def export_page(url):
+            async with semaphore:
+                return await self.export_page(url, old_etags.get(url))
+
+        results = await asyncio.gather(*[export_page(x) for x in urls])
+
+        removed = 0
+        for url in set(old_etags) - set(urls):
+            try:
+                file_path = os.path.join(self.output, page_file(url))
+            except ValueError:  # never written
+                continue
+            await run_in_executor(self.executor, remove_page, file_path)
+            removed += 1
+
+        self._save_manifest()
+        return sum(results), removed
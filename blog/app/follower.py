@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import asyncio
+import logging
+
+from .app import run_in_executor
+from .storage import LogDB
+from .comments import CommentIndex
+from .views import index_documents, invalidate_all_comment_pages
+
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseFollower(object):
+    """
+    Shows comments written by other workers sharing the database file.
+    Every `interval` seconds lines appended to the log by them are read
+    and indexed; a TinyDB file is indexed again when it changes. The
+    database is read in `executor`, the one writing to it, and the indexes
+    are updated on the event loop.
+    """
+
+    def __init__(self, app, *, path=None, interval=1, executor=None):
+        self.app = app
+        self.path = path  # of TinyDB file
+        self.interval = interval
+        self.executor = executor
+        self._mtime = None
+        self._task = None
+        if isinstance(app.db, LogDB):
+            # called in the executor, also when the writer finds them
+            loop = asyncio.get_event_loop()
+            app.db.listeners.append(
+                lambda documents: loop.call_soon_threadsafe(
+                    index_documents, app, documents))
+        else:
+            self._mtime = self._stat()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def _reload(self):
+        # TinyDB caches results of queries written by this process only
+        self.app.db.clear_cache()
+        return CommentIndex.build(self.app.db)
+
+    async def check(self):
+        if isinstance(self.app.db, LogDB):
+            await run_in_executor(self.executor, self.app.db.refresh)
+            return
+
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        self.app.comments = await run_in_executor(
+            self.executor, self._reload)
+        invalidate_all_comment_pages(self.app)
+        logger.info('Indexed %d comments again', len(self.app.comments))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._poll())
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception('Cannot read changes of the database')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from collections import OrderedDict
+from aiohttp import web
+from .app import STREAMED_BODY_KEY
+from .compression import (
+    accepted_encoding, add_vary, compressed_variants)
+from .conditional import (
+    VALIDATORS_KEY, is_not_modified, not_modified_response,
+    validator_headers)
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPage(object):
+    def __init__(self, body, status, content_type, charset, validators=None,
+                 variants=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.charset = charset
+        self.validators = validators or (None, None)  # etag, last modified
+        self.variants = variants or {}  # encoding -> compressed body
+
+    @classmethod
+    def from_response(cls, response, validators=None, compress_min_size=0):
+        body = cached_body(response)
+        variants = compressed_variants(
+            body, response.content_type, compress_min_size)
+        return cls(
+            body, response.status, response.content_type,
+            response.charset, validators, variants)
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(x) for x in self.variants.values())
+
+    def response(self, request):
+        if is_not_modified(request, *self.validators):
+            return not_modified_response(*self.validators)
+
+        response = web.Response(
+            body=self.body, status=self.status,
+            content_type=self.content_type, charset=self.charset,
+            headers=validator_headers(*self.validators))
+        if self.variants:
+            add_vary(response)
+            encoding = accepted_encoding(request, list(self.variants))
+            if encoding is not None:
+                response.body = self.variants[encoding]
+                response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class PageCache(object):
+    """
+    Rendered pages keyed by route, its params and query string. Least
+    recently used pages are dropped when their bodies exceed `max_size`
+    bytes in total.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        # bumped on every invalidation, pages rendered before that are stale
+        self.generation = 0
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+        return page
+
+    def set(self, key, page, *, generation=None):
+        if generation is not None and generation != self.generation:
+            return  # invalidated while it was rendered
+        if page.size > self.max_size:
+            return
+
+        self._remove(key)
+        self._pages[key] = page
+        self.size += page.size
+        while self.size > self.max_size:
+            self._remove(next(iter(self._pages)))
+
+    def _remove(self, key):
+        page = self._pages.pop(key, None)
+        if page is not None:
+            self.size -= page.size
+
+    def invalidate(self, route, **params):
+        """
+        Remove pages of the route, only the ones with given params if any
+        """
+        self.generation += 1
+        params = set(params.items())
+        for key in list(self._pages):
+            key_route, key_params, _ = key
+            if key_route == route and params <= set(key_params):
+                self._remove(key)
+
+    def clear(self):
+        self.generation += 1
+        self._pages.clear()
+        self.size = 0
+
+
+def cache_page(handler):
+    """Mark handler which response can be served from the page cache"""
+    handler.cache_page = True
+    return handler
+
+
+def page_key(request):
+    match_info = request.match_info
+    return (
+        match_info.route.resource.canonical,
+        tuple(sorted(match_info.items())),
+        request.query_string,
+    )
+
+
+def is_anonymous(request):
+    return 'Authorization' not in request.headers and not request.cookies
+
+
+def cached_body(response):
+    """Body of a response, or of a fully streamed one, None if unknown"""
+    if type(response) is web.Response:
+        return response.body
+    return response.get(STREAMED_BODY_KEY)
+
+
+def is_cacheable(response):
+    return (
+        response.status == 200 and cached_body(response) is not None and
+        'Set-Cookie' not in response.headers)
+
+
+async def page_cache_middleware_factory(app, handler):
+    if not getattr(handler, 'cache_page', False):
+        return handler
+
+    async def page_cache_middleware(request):
+        cache = request.app.page_cache
+        if (cache is None or request.method != 'GET' or
+                not is_anonymous(request)):
+            return await handler(request)
+
+        # posts directory changes invalidate pages
+        await request.app.posts.get_index(request.app.executor)
+
+        key = page_key(request)
+        page = cache.get(key)
+        if page is not None:
+            return page.response(request)
+
+        generation = cache.generation
+        response = await handler(request)
+        if is_cacheable(response):
+            page = CachedPage.from_response(
+                response, request.get(VALIDATORS_KEY),
+                request.app.config.compress_min_size)
+            cache.set(key, page, generation=generation)
+            if response.prepared:
+                return response  # streamed, it is sent already
+            # compressed already, if the client accepts it
+            return page.response(request)
+        return response
+
+    return page_cache_middleware
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import asyncio
+import hashlib
+import logging
+import markdown
+
+from functools import lru_cache
+from collections import namedtuple
+from .app import run_in_executor
+from .dates import Timestamp
+
+
+logger = logging.getLogger(__name__)
+
+
+Post = namedtuple('Post', [
+    'title', 'subtitle', 'date', 'author', 'slug',
+    'options', 'content', 'image', 'tags'])
+Post.__new__.__defaults__ = ((),)  # posts without the tags line
+
+
+class PostOptions(frozenset):
+    """
+    Names of options enabled in the post header, readable as attributes
+    (`options.disable_comments`), missing options are False
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return name in self
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return {x: True for x in self} == other
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = frozenset.__hash__
+
+    def __repr__(self):
+        return 'PostOptions({!r})'.format(sorted(self))
+
+
+@lru_cache(maxsize=256)
+def parse_post_options(options_str):
+    # posts share few combinations of options, so instances are shared too
+    return PostOptions(
+        sys.intern(x.strip()) for x in options_str.split(',') if x.strip())
+
+
+def parse_post_tags(tags_str):
+    return tuple(sorted({
+        sys.intern(x.strip().lower())
+        for x in tags_str.split(',') if x.strip()}))
+
+
+HEADER_LINES = 7
+# optional line after the header, `######## tag1, tag2`
+TAGS_PREFIX = '########'
+
+
+MARKDOWN_EXTENSIONS = []
+
+
+def render_markdown(source):
+    return markdown.markdown(source, extensions=MARKDOWN_EXTENSIONS)
+
+
+def render_cache_config():
+    """Everything besides the source what changes the rendered HTML"""
+    return 'markdown {} {!r}'.format(
+        markdown.__version__, MARKDOWN_EXTENSIONS)
+
+
+def read_post_source(file_path):
+    with open(file_path) as f:
+        content = f.readlines()[HEADER_LINES:]
+    if content and content[0].startswith(TAGS_PREFIX):
+        content = content[1:]
+    return '\n'.join(content)
+
+
+def render_post_file(file_path, cache=None):
+    """
+    HTML of the post and count of bytes written to the render cache, which
+    the caller passes to `cache.added` in the process owning the cache
+    """
+    source = read_post_source(file_path)
+    if cache is None:
+        return render_markdown(source), 0
+    return cache.render(source, render_markdown)
+
+
+class PostContent(object):
+    """
+    Markdown body of a post file. It is read and rendered to HTML only
+    when used for the first time (e.g. printed in a template), listings
+    of posts never pay for it.
+    """
+
+    def __init__(self, file_path, cache=None, *, digest=None, mtime=None):
+        self.file_path = file_path
+        self.cache = cache
+        self.digest = digest  # changes with the file
+        self.mtime = mtime
+        self._html = None
+
+    def read_source(self):
+        return read_post_source(self.file_path)
+
+    @property
+    def rendered(self):
+        return self._html is not None
+
+    def _set_html(self, html, written):
+        self._html = html
+        if written:
+            self.cache.added(written)
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._set_html(*render_post_file(self.file_path, self.cache))
+        return self._html
+
+    async def render(self, executor=None):
+        if self._html is None:
+            self._set_html(*await run_in_executor(
+                executor, render_post_file, self.file_path, self.cache))
+        return self._html
+
+    def __str__(self):
+        return self.html
+
+    def __html__(self):
+        return self.html
+
+    def __eq__(self, other):
+        if isinstance(other, PostContent):
+            other = other.html
+        return self.html == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'PostContent({!r})'.format(self.file_path)
+
+
+def read_post_header(file_path):
+    """
+    Header of the post file, its body is not read. Digest of the file is
+    made of its size and modification time.
+    """
+    with open(file_path, encoding='utf-8') as f:
+        header = [f.readline() for _ in range(HEADER_LINES)]
+        tags = f.readline()
+        stat = os.fstat(f.fileno())
+
+    if not header[-1]:
+        raise ValueError('Incomplete header of post {}'.format(file_path))
+
+    title, subtitle, date, slug, image, author, options = [
+        x.strip('#').strip() for x in header]
+    tags = tags.strip('#').strip() if tags.startswith(TAGS_PREFIX) else ''
+    digest = '{} {}'.format(stat.st_size, stat.st_mtime_ns)
+    return {
+        'title': title, 'subtitle': subtitle, 'date': str(Timestamp(date)),
+        'slug': slug,
+        'image': image, 'author': author, 'options': options, 'tags': tags,
+        'digest': hashlib.sha1(digest.encode('utf-8')).hexdigest(),
+    }
+
+
+def make_post(file_path, header, render_cache=None, mtime=None,
+              content=None):
+    header = dict(header)
+    header['options'] = parse_post_options(header['options'])
+    header['tags'] = parse_post_tags(header.get('tags', ''))
+    header['date'] = Timestamp(header['date'])
+    # the same authors and slugs are repeated across posts and comments
+    header['author'] = sys.intern(header['author'])
+    header['slug'] = sys.intern(header['slug'])
+    digest = header.pop('digest')
+    if content is None:
+        content = PostContent(
+            file_path, render_cache, digest=digest, mtime=mtime)
+    return Post(content=content, **header)
+
+
+def read_post_headers(path, names):
+    """
+    Headers of given post files, None for the ones which cannot be parsed.
+    Only plain data is returned, so it can be run in a process pool.
+    """
+    ret = {}
+    for name in names:
+        try:
+            ret[name] = read_post_header(os.path.join(path, name))
+        except (OSError, ValueError):
+            logger.exception('Cannot parse post %s', name)
+            ret[name] = None
+    return ret
+
+
+def read_post_sources(file_paths):
+    """
+    Markdown sources of posts given as slug -> file path, None for the ones
+    which cannot be read. Only plain data is returned, so it can be run in
+    a process pool.
+    """
+    ret = {}
+    for slug, file_path in file_paths.items():
+        try:
+            ret[slug] = read_post_source(file_path)
+        except (OSError, ValueError):
+            logger.exception('Cannot read post %s', file_path)
+            ret[slug] = None
+    return ret
+
+
+def scan_posts(path):
+    """Stat keys of all post files in the directory"""
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        logger.warning('Posts directory %s does not exist', path)
+        return {}
+
+    ret = {}
+    for name in names:
+        if not name.endswith('.md'):
+            continue
+        try:
+            ret[name] = stat_key(os.stat(os.path.join(path, name)))
+        except FileNotFoundError:  # removed in the meantime
+            continue
+    return ret
+
+
+def sort_by_date(post):
+    return post.date.timestamp
+
+
+def stat_key(stat):
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def post_timestamp(post):
+    """Latest of the post date and its file modification time"""
+    timestamp = post.date.timestamp
+    if post.content.mtime is not None:
+        timestamp = max(timestamp, post.content.mtime)
+    return timestamp
+
+
+def split_pages(posts, page_size):
+    return [posts[i:i + page_size] for i in range(0, len(posts), page_size)]
+
+
+def group_pages(posts, keys, page_size):
+    """key -> pages of posts having it, `keys` gives keys of a post"""
+    groups = {}
+    for post in posts:
+        for key in keys(post):
+            groups.setdefault(key, []).append(post)
+    return {
+        key: split_pages(group, page_size) for key, group in groups.items()}
+
+
+class PostIndex(object):
+    """
+    Immutable lookup structures over posts sorted from the newest one:
+    slug -> post mapping and posts already split into pages, all of them
+    and by tag and author.
+    """
+
+    def __init__(self, posts, page_size):
+        self.posts = posts
+        self.page_size = page_size
+        # iterate from the oldest, so the newest post wins duplicated slug
+        self.by_slug = {x.slug: x for x in reversed(posts)}
+        self.pages = split_pages(posts, page_size)
+        self.tags = group_pages(posts, lambda x: x.tags, page_size)
+        self.authors = group_pages(posts, lambda x: (x.author,), page_size)
+
+        # validators of listings, which change with any post
+        digest = hashlib.sha1()
+        for post in posts:
+            digest.update((post.content.digest or post.slug).encode('utf-8'))
+        self.etag = digest.hexdigest()
+        self.last_modified = max(
+            [post_timestamp(x) for x in posts], default=None)
+
+    @property
+    def total_pages(self):
+        return len(self.pages)
+
+    def get(self, slug):
+        return self.by_slug.get(slug)
+
+    def page(self, page):
+        if 1 <= page <= len(self.pages):
+            return self.pages[page - 1]
+        return []
+
+
+class PostCatalog(object):
+    """
+    Parsed posts of a directory. Every access (or a watcher) stats the
+    directory and re-parses only files that were added or whose mtime, size
+    or inode changed since the previous check. Indexes are rebuilt on change
+    and swapped as a whole, so a reader never sees a half-updated state.
+
+    With `snapshots`, any change loads all posts, rendered, from a snapshot
+    shared by workers instead, it is written by the first one to need it.
+    """
+
+    def __init__(self, path, *, page_size=5, render_cache=None,
+                 snapshots=None):
+        self.path = path
+        self.page_size = page_size
+        self.render_cache = render_cache
+        # snapshot.SnapshotStore shared with other workers, if any
+        self.snapshots = snapshots
+        self._files = {}  # file name -> (stat key, post or None)
+        self._index = PostIndex([], page_size)
+        self._pending = None
+        self._dirty = False  # refresh requested during the pending one
+        # called with slugs of modified posts after the index is swapped
+        self.listeners = []
+        # synchronize with the directory on every access, turned off when
+        # a watcher pushes the changes
+        self.auto_refresh = True
+
+    def _changed(self, files):
+        return [
+            name for name, key in files.items()
+            if name not in self._files or self._files[name][0] != key]
+
+    def _is_changed(self, files):
+        return bool(set(self._files) - set(files) or self._changed(files))
+
+    def _swap(self, files, snapshot_files):
+        """Replace all posts by the ones loaded from a snapshot"""
+        slugs = set()
+        for name in set(self._files) | set(snapshot_files):
+            _, old_post = self._files.get(name, (None, None))
+            _, post = snapshot_files.get(name, (None, None))
+            if (old_post is None or post is None or
+                    old_post.content.digest != post.content.digest):
+                slugs.update(x.slug for x in (old_post, post) if x)
+
+        self._files = {name: (key, None) for name, key in files.items()}
+        self._files.update(snapshot_files)
+        self._rebuild(slugs)
+        return True
+
+    def _rebuild(self, slugs):
+        posts = [x for _, x in self._files.values() if x is not None]
+        posts.sort(key=sort_by_date, reverse=True)
+        self._index = PostIndex(posts, self.page_size)
+
+        for listener in self.listeners:
+            listener(slugs)
+
+    def _update(self, files, headers):
+        changed = False
+        slugs = set()  # slugs of changed, added and removed posts
+
+        for name in set(self._files) - set(files):
+            _, post = self._files.pop(name)
+            if post is not None:
+                slugs.add(post.slug)
+            changed = True
+
+        for name, header in headers.items():
+            _, old_post = self._files.get(name, (None, None))
+            if old_post is not None:
+                slugs.add(old_post.slug)
+
+            post = None
+            if header is not None:
+                post = make_post(
+                    os.path.join(self.path, name), header, self.render_cache,
+                    mtime=files[name][0] / 1e9)
+                slugs.add(post.slug)
+            self._files[name] = (files[name], post)
+            changed = True
+
+        if changed:
+            self._rebuild(slugs)
+
+        return changed
+
+    def _load_snapshot(self, key):
+        try:
+            return self.snapshots.load(key, self.path)
+        except Exception:
+            logger.exception('Cannot load snapshot of posts')
+            return None
+
+    async def _refresh(self, executor):
+        """Synchronize with the directory, return True if anything changed"""
+        files = await run_in_executor(executor, scan_posts, self.path)
+        if self.snapshots is not None and self._is_changed(files):
+            try:
+                key, written = await run_in_executor(
+                    executor, self.snapshots.build, self.path, files)
+            except Exception:
+                logger.exception('Cannot build snapshot of posts')
+            else:
+                if written:
+                    self.snapshots.render_cache.added(written)
+                snapshot_files = self._load_snapshot(key)
+                if snapshot_files is not None:
+                    return self._swap(files, snapshot_files)
+
+        headers = {}
+        changed = self._changed(files)
+        if changed:
+            headers = await run_in_executor(
+                executor, read_post_headers, self.path, changed)
+        return self._update(files, headers)
+
+    async def _refresh_until_clean(self, executor):
+        changed = False
+        while True:
+            self._dirty = False
+            changed = await self._refresh(executor) or changed
+            if not self._dirty:
+                return changed
+
+    async def refresh_async(self, executor=None):
+        """
+        Synchronize with the directory, file system work is done in the
+        executor. Concurrent callers share one pending refresh; the directory
+        may have changed after it was scanned, so one more scan follows it
+        then.
+        """
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.ensure_future(
+                self._refresh_until_clean(executor))
+        else:
+            self._dirty = True
+        return await asyncio.shield(self._pending)
+
+    async def prerender(self, executor=None):
+        """
+        Render bodies of all posts which were not rendered yet, in parallel
+        when a pool is given. Return counts of rendered and failed posts.
+        """
+        contents = [x.content for x in self._index.posts]
+        results = await asyncio.gather(
+            *[x.render(executor) for x in contents], return_exceptions=True)
+
+        failed = 0
+        for content, result in zip(contents, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    'Cannot render post %s: %r', content.file_path, result)
+                failed += 1
+        return len(contents) - failed, failed
+
+    async def get_index(self, executor=None):
+        if self.auto_refresh:
+            await self.refresh_async(executor)
+        return self._index
+
+    @property
+    def current_index(self):
+        """Index as of the last refresh, without synchronizing"""
+        return self._index
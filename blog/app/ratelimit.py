@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+import logging
+
+from functools import wraps
+from collections import OrderedDict
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """
+    Token bucket per key: `burst` requests at once, then `rate` requests
+    per second. Only `max_keys` least recently used buckets are kept,
+    a dropped one starts full again, so memory does not grow with clients.
+    """
+
+    def __init__(self, rate, burst, *, max_keys=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()  # key -> (tokens, time of update)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, key):
+        """Take a token, return 0 or seconds until one is available"""
+        now = self.clock()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+def create_rate_limiters(app):
+    """Limiters by client IP and by post slug, None if disabled"""
+    config = app['config']
+    app.client_limiter = app.post_limiter = None
+    if config.rate_limit_client:
+        app.client_limiter = RateLimiter(
+            config.rate_limit_client, config.rate_limit_client_burst,
+            max_keys=config.rate_limit_keys)
+    if config.rate_limit_post:
+        app.post_limiter = RateLimiter(
+            config.rate_limit_post, config.rate_limit_post_burst,
+            max_keys=config.rate_limit_keys)
+
+
+def check_rate_limit(limiter, key):
+    if limiter is None:
+        return
+    wait = limiter.acquire(key)
+    if wait:
+        logger.warning('Rate limit exceeded by %s', key)
+        raise web.HTTPTooManyRequests(
+            headers={'Retry-After': str(math.ceil(wait))})
+
+
+def rate_limited(handler):
+    """
+    Answer 429 to clients sending too many requests, before the body is
+    read at all
+    """
+    @wraps(handler)
+    async def fun(request, *args, **kwargs):
+        check_rate_limit(request.app.client_limiter, request.remote)
+        return await handler(request, *args, **kwargs)
+
+    return fun
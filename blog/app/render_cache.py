@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import os
+import zlib
+import hashlib
+import logging
+import tempfile
+
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCache(object):
+    """
+    Directory of zlib compressed HTML renders shared by all workers and
+    restarts. Entries are keyed by hash of the markdown source and the
+    renderer configuration, least recently used ones are removed when the
+    directory grows over `max_size` bytes.
+
+    Writes do not evict, they return their size, which the owner of the
+    cache passes to `added` after an executor returns, so copies passed to
+    a process pool never scan the directory. The size is scanned once and
+    then counted, eviction goes down to `LOW_WATER` of the limit, so the
+    directory is not scanned on every write. Writes of other workers are
+    seen by the next scan.
+    """
+
+    SUFFIX = '.html.z'
+    LOW_WATER = 0.9
+
+    def __init__(self, path, max_size, *, config=''):
+        self.path = path
+        self.max_size = max_size
+        self.config = config
+        self._size = None  # of the directory, unknown before a scan
+
+    def key(self, source):
+        digest = hashlib.sha256(self.config.encode('utf-8'))
+        digest.update(source.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _file_path(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def get(self, key):
+        file_path = self._file_path(key)
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            os.utime(file_path)  # mark as recently used
+            return zlib.decompress(data).decode('utf-8')
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, UnicodeDecodeError):
+            logger.exception('Broken render cache entry %s', file_path)
+            self._remove(file_path)
+            return None
+
+    def set(self, key, html):
+        """Store the render, return count of bytes written"""
+        os.makedirs(self.path, exist_ok=True)
+        data = zlib.compress(html.encode('utf-8'))
+
+        # write to temporary file first, so readers never see partial data
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._file_path(key))
+        except OSError:
+            logger.exception('Cannot write render cache entry %s', key)
+            self._remove(tmp_path)
+            return 0
+        return len(data)
+
+    def added(self, size):
+        """Count bytes written by `set`, evict when over the limit"""
+        if self._size is not None:
+            self._size += size
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+
+    def _remove(self, file_path):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def _entries(self):
+        ret = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                ret.append((stat.st_mtime, stat.st_size, entry.path))
+        return ret
+
+    def evict(self):
+        """
+        Remove least recently used entries, if the directory is over the
+        size limit, until it is under `LOW_WATER` of it
+        """
+        entries = self._entries()
+        total = sum(x[1] for x in entries)
+        if total > self.max_size:
+            entries.sort()
+            for _, size, file_path in entries:
+                if total <= self.max_size * self.LOW_WATER:
+                    break
+                self._remove(file_path)
+                total -= size
+        self._size = total
+
+    def render(self, source, render):
+        """
+        HTML of the source from the cache, rendered on a miss, and count
+        of bytes written to the cache
+        """
+        key = self.key(source)
+        html = self.get(key)
+        if html is not None:
+            return html, 0
+        html = render(source)
+        return html, self.set(key, html)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import re
+import math
+import asyncio
+import logging
+
+from collections import defaultdict
+from .app import run_in_executor
+from .posts import read_post_sources
+
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return [x.lower() for x in TOKEN_RE.findall(text)]
+
+
+class SearchIndex(object):
+    """
+    Inverted index of posts: term -> {slug: positions of the term}, ranked
+    with BM25. Posts are added and removed one by one, when their files
+    change, so a query never renders posts. Changed posts are read again in
+    the executor by `refresh`, before the next query.
+
+    A query in quotes matches only posts with the terms next to each other.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.lengths = {}  # slug -> count of terms
+        self.terms = {}  # slug -> distinct terms, to remove the post
+        self.total_length = 0
+        self._stale = set()  # slugs of posts changed since the last refresh
+        self._pending = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __contains__(self, slug):
+        return slug in self.lengths
+
+    def add(self, slug, text):
+        self.remove(slug)
+        terms = tokenize(text)
+        positions = defaultdict(list)
+        for position, term in enumerate(terms):
+            positions[term].append(position)
+        for term, term_positions in positions.items():
+            self.postings[term][slug] = term_positions
+        self.lengths[slug] = len(terms)
+        self.terms[slug] = tuple(positions)
+        self.total_length += len(terms)
+
+    def remove(self, slug):
+        if slug not in self.lengths:
+            return
+        for term in self.terms.pop(slug):
+            postings = self.postings[term]
+            del postings[slug]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(slug)
+
+    def _score(self, terms, slugs):
+        average = self.total_length / len(self.lengths)
+        scores = defaultdict(float)
+        for term in set(terms):
+            postings = self.postings.get(term, {})
+            idf = math.log(
+                1 + (len(self.lengths) - len(postings) + 0.5) /
+                (len(postings) + 0.5))
+            for slug in slugs:
+                if slug not in postings:
+                    continue
+                frequency = len(postings[slug])
+                norm = 1 - self.B + self.B * self.lengths[slug] / average
+                scores[slug] += idf * frequency * (self.K1 + 1) / (
+                    frequency + self.K1 * norm)
+        return scores
+
+    def _phrase_matches(self, terms, slug):
+        positions = [set(self.postings[x][slug]) for x in terms]
+        return any(
+            all(start + i in x for i, x in enumerate(positions))
+            for start in positions[0])
+
+    def search(self, query):
+        """Slugs of matching posts from the most relevant one"""
+        phrase = len(query) > 1 and query[0] == query[-1] == '"'
+        terms = tokenize(query)
+        if not terms or not self.lengths:
+            return []
+
+        if phrase:
+            if any(x not in self.postings for x in terms):
+                return []
+            slugs = set.intersection(
+                *[set(self.postings[x]) for x in terms])
+            slugs = [x for x in slugs if self._phrase_matches(terms, x)]
+        else:
+            slugs = set()
+            for term in terms:
+                slugs.update(self.postings.get(term, {}))
+
+        scores = self._score(terms, slugs)
+        return sorted(scores, key=lambda x: (-scores[x], x))
+
+    def invalidate(self, slugs):
+        """Mark posts to be indexed again, after their files changed"""
+        self._stale.update(slugs)
+
+    async def _refresh(self, catalog, executor):
+        while self._stale:
+            slugs, self._stale = self._stale, set()
+            index = catalog.current_index
+            posts = {x: index.get(x) for x in slugs}
+            sources = await run_in_executor(
+                executor, read_post_sources,
+                {x: y.content.file_path for x, y in posts.items() if y})
+            for slug, post in posts.items():
+                if slug in self._stale:
+                    continue  # changed again in the meantime
+                source = sources.get(slug)
+                if source is None:
+                    self.remove(slug)
+                    continue
+                self.add(slug, '\n'.join((post.title, post.subtitle, source)))
+
+    async def refresh(self, catalog, executor=None):
+        """
+        Index posts of the catalog marked as changed, their files are read in
+        the executor. Concurrent callers share one pending refresh.
+        """
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.ensure_future(
+                self._refresh(catalog, executor))
+        await asyncio.shield(self._pending)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import mmap
+import fcntl
+import struct
+import hashlib
+import logging
+import tempfile
+
+from .posts import (
+    PostContent, make_post, read_post_headers, render_post_file,
+    render_cache_config)
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'BLOGSNP2'  # format version is part of it
+LENGTH = struct.Struct('<Q')
+SUFFIX = '.snap'
+
+
+class PostSnapshot(object):
+    """
+    Read-only memory map of a snapshot file: post headers and rendered
+    bodies of a posts directory. All workers map the same file, so bodies
+    are kept in memory once, in the page cache of the system.
+
+        MAGIC | length of metadata | metadata JSON | bodies
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a snapshot file {}'.format(path))
+        start = len(MAGIC) + LENGTH.size
+        length, = LENGTH.unpack_from(self._map, len(MAGIC))
+        metadata = json.loads(self._map[start:start + length].decode('utf-8'))
+        self.key = metadata['key']
+        # render_cache_config() of the bodies
+        self.renderer = metadata.get('renderer')
+        self.posts = metadata['posts']
+        self._bodies = start + length
+
+    def body(self, offset, length):
+        """HTML bytes of a post without copying them"""
+        start = self._bodies + offset
+        return memoryview(self._map)[start:start + length]
+
+
+def write_snapshot(path, key, posts, renderer=None):
+    """
+    Write snapshot of posts given as (file name, stat key, header, HTML or
+    None when it cannot be rendered) atomically, HTML can be encoded already
+    """
+    metadata, bodies = [], []
+    offset = 0  # from the start of bodies
+    for name, stat, header, html in posts:
+        entry = {'name': name, 'stat': stat, 'header': header}
+        if html is not None:
+            body = html.encode('utf-8') if isinstance(html, str) else html
+            entry.update(offset=offset, length=len(body))
+            offset += len(body)
+            bodies.append(body)
+        metadata.append(entry)
+    data = json.dumps({
+        'key': key, 'renderer': renderer, 'posts': metadata}).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(LENGTH.pack(len(data)))
+            f.write(data)
+            for body in bodies:
+                f.write(body)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class SnapshotContent(PostContent):
+    """
+    Rendered body of a post in a snapshot, nothing is rendered again. It is
+    decoded from the mapped file once, when it is used for the first time;
+    posts which are not shown are never copied out of the page cache.
+    """
+
+    def __init__(self, snapshot, offset, length, file_path, **kwargs):
+        super().__init__(file_path, **kwargs)
+        self.snapshot = snapshot
+        self.offset = offset
+        self.length = length
+
+    @property
+    def rendered(self):
+        return True
+
+    @property
+    def body(self):
+        return self.snapshot.body(self.offset, self.length)
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._html = str(self.body, 'utf-8')
+        return self._html
+
+    async def render(self, executor=None):
+        return self.html
+
+
+class SnapshotStore(object):
+    """
+    Directory of snapshots shared by workers. Snapshot of a posts directory
+    is named by hash of stat keys of its files and of the renderer, so
+    a worker which sees the same files finds the snapshot written by
+    another one. It keeps no state besides its settings, so it can be
+    passed to a process pool.
+    """
+
+    def __init__(self, path, *, render_cache=None):
+        self.path = path
+        self.render_cache = render_cache
+
+    def key(self, files):
+        digest = hashlib.sha1(MAGIC)
+        digest.update(render_cache_config().encode('utf-8'))
+        digest.update(json.dumps(sorted(files.items())).encode('utf-8'))
+        return digest.hexdigest()
+
+    def snapshot_path(self, key):
+        return os.path.join(self.path, 'posts-' + key + SUFFIX)
+
+    def open(self, key):
+        path = self.snapshot_path(key)
+        try:
+            return PostSnapshot(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.exception('Broken snapshot %s', path)
+            return None
+
+    def latest(self):
+        """Snapshot written last, None if there is none"""
+        names = [x for x in os.listdir(self.path) if x.endswith(SUFFIX)]
+        if not names:
+            return None
+        name = max(names, key=lambda x: os.path.getmtime(
+            os.path.join(self.path, x)))
+        return self.open(name[len('posts-'):-len(SUFFIX)])
+
+    def reusable(self, files):
+        """
+        Entries of the latest snapshot for files which did not change since
+        it was written, by file name, with the snapshot to read bodies from
+        """
+        previous = self.latest()
+        if previous is None or previous.renderer != render_cache_config():
+            return None, {}
+        return previous, {
+            x['name']: x for x in previous.posts
+            if 'offset' in x and tuple(x['stat']) == files.get(x['name'])}
+
+    def load(self, key, posts_path):
+        """
+        Posts of the snapshot as catalog files: file name -> (stat key,
+        post), None if there is no such snapshot
+        """
+        snapshot = self.open(key)
+        if snapshot is None:
+            return None
+
+        ret = {}
+        for entry in snapshot.posts:
+            file_path = os.path.join(posts_path, entry['name'])
+            stat = tuple(entry['stat'])
+            header = entry['header']
+            mtime = stat[0] / 1e9
+            content = None  # rendered on use, if it failed before
+            if 'offset' in entry:
+                content = SnapshotContent(
+                    snapshot, entry['offset'], entry['length'], file_path,
+                    cache=self.render_cache, digest=header['digest'],
+                    mtime=mtime)
+            ret[entry['name']] = (stat, make_post(
+                file_path, header, self.render_cache, mtime=mtime,
+                content=content))
+        return ret
+
+    def build(self, posts_path, files):
+        """
+        Render all posts into a snapshot, unless another worker did it
+        already; unchanged posts are copied from the previous one. Return
+        its key and count of bytes written to the render cache.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        key = self.key(files)
+        written = 0
+        with open(os.path.join(self.path, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.snapshot_path(key)):
+                return key, written
+
+            previous, reused = self.reusable(files)
+            posts = []
+            for name in sorted(reused):
+                entry = reused[name]
+                posts.append((name, files[name], entry['header'],
+                              previous.body(entry['offset'], entry['length'])))
+
+            headers = read_post_headers(
+                posts_path, sorted(set(files) - set(reused)))
+            for name, header in headers.items():
+                if header is None:
+                    continue
+                file_path = os.path.join(posts_path, name)
+                try:
+                    html, size = render_post_file(
+                        file_path, self.render_cache)
+                    written += size
+                except Exception:
+                    logger.exception('Cannot render post %s', name)
+                    html = None
+                posts.append((name, files[name], header, html))
+
+            write_snapshot(
+                self.snapshot_path(key), key, posts, render_cache_config())
+            self.prune(key)
+            logger.info(
+                'Written snapshot of %d posts %s, %d of them copied',
+                len(posts), key[:10], len(reused))
+        return key, written
+
+    def prune(self, key):
+        """Remove older snapshots, mapped ones stay readable until unmapped"""
+        for name in os.listdir(self.path):
+            if name.endswith(SUFFIX) and name != os.path.basename(
+                    self.snapshot_path(key)):
+                os.remove(os.path.join(self.path, name))
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import fcntl
+import logging
+import tempfile
+
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class LogDB(object):
+    """
+    Database with the subset of TinyDB interface used by the application.
+    Documents are kept in memory and every change appends one JSON line to
+    the file, instead of rewriting the whole database like TinyDB does:
+
+        {"id": 1, "doc": {...}}   inserted document
+        {"id": 1, "deleted": 1}   removed document
+
+    Several processes (workers) can use the same file. Every change is
+    made under an exclusive lock of `<path>.lock`, after reading lines
+    appended by other processes, so ids are unique, and is fsynced.
+    `refresh` reads lines of other processes and passes documents inserted
+    by them to `listeners`.
+
+    The file is compacted (rewritten with live documents only) on open and
+    when removed documents take a big part of it. It is done under the
+    same lock, other processes see the file was replaced and load it again.
+
+    With `read_only` the file is only read, it is never created, repaired
+    or compacted, and changes raise PermissionError.
+    """
+
+    COMPACT_MIN_GARBAGE = 100
+
+    def __init__(self, path, *, import_path=None, compact_ratio=0.5,
+                 read_only=False):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.read_only = read_only
+        # called with documents inserted by other processes
+        self.listeners = []
+        self._file = None  # for appending
+        self._inode = None  # of the file being appended to
+        self._offset = 0  # bytes of the file read so far
+        self._docs = OrderedDict()  # doc id -> document
+        self._last_id = 0
+        self._garbage = 0  # lines which do not describe a live document
+        self._lock_file = open(path + '.lock', 'a')
+
+        if read_only:
+            with self._locked(fcntl.LOCK_SH):
+                if os.path.exists(path):
+                    self._catch_up()
+                elif import_path and os.path.exists(import_path):
+                    self._import_tinydb(import_path)
+            return
+
+        with self._locked(fcntl.LOCK_EX):
+            imported = False
+            if (not os.path.exists(path) and import_path and
+                    os.path.exists(import_path)):
+                self._import_tinydb(import_path)
+                imported = True
+            else:
+                self._catch_up(repair=True)
+
+            if self._garbage or imported:
+                self._compact()
+
+    @contextmanager
+    def _locked(self, operation):
+        fcntl.flock(self._lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        # read-only one is kept open to notice the file was replaced
+        self._file = open(self.path, 'rb' if self.read_only else 'ab')
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _catch_up(self, *, repair=False):
+        """
+        Apply lines appended by other processes since the last call, the
+        lock has to be held. A torn line (crash during write) is ended
+        with `repair`, so the next line is not glued to it.
+        """
+        known = None
+        if (self._file is None or not os.path.exists(self.path) or
+                os.stat(self.path).st_ino != self._inode):
+            # compacted by another process, or opened for the first time
+            known = set(self._docs)
+            self._docs = OrderedDict()
+            self._last_id = self._garbage = self._offset = 0
+            self._open()
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            lines = f.read().split(b'\n')
+        tail = lines.pop()  # empty, unless the last line is torn
+
+        inserted = []
+        for line in lines:
+            self._offset += len(line) + 1
+            try:
+                record = json.loads(line.decode('utf-8'))
+                doc_id = record['id']
+            except (ValueError, KeyError, TypeError):
+                logger.warning('Skipping broken line in %s', self.path)
+                self._garbage += 1
+                continue
+
+            if 'doc' in record:
+                if doc_id in self._docs:
+                    self._garbage += 1
+                self._docs[doc_id] = record['doc']
+                if known is None or doc_id not in known:
+                    inserted.append(dict(record['doc']))
+            else:
+                self._docs.pop(doc_id, None)
+                self._garbage += 2  # both insert and delete lines
+            self._last_id = max(self._last_id, doc_id)
+
+        if tail and repair:
+            logger.warning('Skipping broken line in %s', self.path)
+            self._file.write(b'\n')
+            self._offset += len(tail) + 1
+            self._garbage += 1
+
+        if inserted:
+            for listener in self.listeners:
+                listener(inserted)
+        return inserted
+
+    def refresh(self):
+        """Read changes of other processes, return inserted documents"""
+        with self._locked(fcntl.LOCK_SH):
+            return self._catch_up()
+
+    def _import_tinydb(self, import_path):
+        logger.info('Importing TinyDB database %s', import_path)
+        with open(import_path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        table = data.get('_default', {})
+        for doc_id in sorted(table, key=int):
+            self._docs[int(doc_id)] = table[doc_id]
+            self._last_id = max(self._last_id, int(doc_id))
+
+    def _write(self, records):
+        data = ''.join(
+            json.dumps(x, ensure_ascii=False) + '\n' for x in records)
+        data = data.encode('utf-8')
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._offset += len(data)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError(
+                'Database {} is opened read-only'.format(self.path))
+
+    def compact(self):
+        """Rewrite the file with live documents only"""
+        self._check_writable()
+        with self._locked(fcntl.LOCK_EX):
+            self._catch_up(repair=True)
+            self._compact()
+
+    def _compact(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            for doc_id, doc in self._docs.items():
+                line = json.dumps(
+                    {'id': doc_id, 'doc': doc}, ensure_ascii=False) + '\n'
+                size += f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        self._open()
+        self._offset = size
+        self._garbage = 0
+        logger.info('Compacted %s, %d documents', self.path, len(self._docs))
+
+    def _maybe_compact(self):
+        if (self._garbage >= self.COMPACT_MIN_GARBAGE and
+                self._garbage > len(self._docs) * self.compact_ratio):
+            self._compact()
+
+    def insert(self, document):
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents):
+        self._check_writable()
+        with self._locked(fcntl.LOCK_EX):
+            # ids of documents inserted by other processes are known then
+            self._catch_up(repair=True)
+            records = []
+            for document in documents:
+                self._last_id += 1
+                records.append({'id': self._last_id, 'doc': dict(document)})
+
+            self._write(records)
+            for record in records:
+                self._docs[record['id']] = record['doc']
+        return [x['id'] for x in records]
+
+    def remove(self, cond):
+        """Remove documents matching the condition, return their ids"""
+        self._check_writable()
+        with self._locked(fcntl.LOCK_EX):
+            self._catch_up(repair=True)
+            removed = [k for k, v in self._docs.items() if cond(v)]
+            if not removed:
+                return []
+
+            self._write([{'id': x, 'deleted': 1} for x in removed])
+            for doc_id in removed:
+                del self._docs[doc_id]
+            self._garbage += 2 * len(removed)
+            self._maybe_compact()
+        return removed
+
+    def search(self, cond):
+        return [dict(x) for x in self._docs.values() if cond(x)]
+
+    def all(self):
+        return [dict(x) for x in self._docs.values()]
+
+    def __len__(self):
+        return len(self._docs)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._lock_file.close()
@@ -10,8 +10,44 @@ from app.views import Post, Comment, parse_post_options
 
 
 @pytest.fixture
-def app(loop):
-    return create(loop, conf=TestConfig)
+def posts_path(tmpdir):
+    return str(tmpdir.mkdir('posts'))
+
+
+@pytest.fixture
+def config_overrides():
+    """Override with `pytest.mark.parametrize` to change the config"""
+    return {}
+
+
+@pytest.fixture
+def app(loop, posts_path, config_overrides):
+    attrs = dict(config_overrides, posts_path=posts_path)
+    conf = type('TestConfig', (TestConfig,), attrs)
+    return create(loop, conf=conf)
+
+
+def write_post(posts_path, post):
+    options = ','.join(sorted(post.options))
+    lines = [
+        '# ' + post.title, '## ' + post.subtitle, '### ' + post.date,
+        '#### ' + post.slug, '##### ' + post.image, '###### ' + post.author,
+        '####### ' + options, '', post.content,
+    ]
+    if post.tags:
+        lines.insert(7, '######## ' + ', '.join(post.tags))
+    file_path = os.path.join(posts_path, post.slug + '.md')
+    with open(file_path, 'w') as f:
+        f.write('\n'.join(lines))
+    return file_path
+
+
+@pytest.fixture
+def add_posts(posts_path):
+    def fun(posts):
+        return [write_post(posts_path, x) for x in posts]
+
+    return fun
 
 
 @pytest.yield_fixture
@@ -47,7 +83,9 @@ def test_client_auth(
         setattr(obj, new_method_name, original_fun)
 
         async def fun(url, **kwargs):
-            kwargs.update(fixt_auth_header)
+            headers = dict(kwargs.get('headers') or {})
+            headers.update(fixt_auth_header['headers'])
+            kwargs['headers'] = headers
 
             new_fun = getattr(obj, new_method_name)
             return await new_fun(url, **kwargs)
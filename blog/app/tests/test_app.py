@@ -2,7 +2,8 @@
 import pytest
 import json
 from datetime import datetime, timedelta
-from app.app import safe_unpack
+from concurrent.futures import ThreadPoolExecutor
+from app.app import safe_unpack, run_in_executor
 from app.tests.conftest import Any, AlmostSimilarDateTime
 
 
@@ -16,3 +17,10 @@ from app.tests.conftest import Any, AlmostSimilarDateTime
 ))
 def test_safe_unpack(data, count, expected):
     assert safe_unpack(data, count) == expected
+
+
+async def test_run_in_executor(loop):
+    assert await run_in_executor(None, max, 1, 2) == 2
+
+    with ThreadPoolExecutor(1) as executor:
+        assert await run_in_executor(executor, max, 1, 2) == 2
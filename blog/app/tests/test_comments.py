@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import pytest
+import mock
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+from app.comments import CommentIndex
+from app.views import Comment, Contact, to_tinydb
+
+
+def comment(slug, content):
+    return Comment(
+        author='A', date='2016-04-05T12:52:00', content=content,
+        email='a@a.pl', post_slug=slug)
+
+
+def test_comment_index_build():
+    db = TinyDB(storage=MemoryStorage)
+    db.insert(to_tinydb(comment('a', '1')))
+    db.insert(to_tinydb(Contact(
+        email='a@a.pl', name='A', message='m', date='2016-04-05T12:52:00')))
+    db.insert(to_tinydb(comment('b', '2')))
+    db.insert(to_tinydb(comment('a', '3')))
+
+    index = CommentIndex.build(db)
+    assert len(index) == 3
+    assert index.get('a') == [comment('a', '1'), comment('a', '3')]
+    assert index.get('b') == [comment('b', '2')]
+    assert index.get('c') == []
+
+
+def test_comment_index_add():
+    index = CommentIndex()
+    index.add(comment('a', '1'))
+    index.add(comment('a', '2'))
+    assert [x.content for x in index.get('a')] == ['1', '2']
+
+    first, second = index.get('a')
+    assert first.date.datetime.year == 2016
+    assert first.author is second.author
+
+
+async def test_post_view_does_not_search_db(
+        test_client_auth, app, add_posts, fixt_blog_post, fixt_blog_comment):
+    add_posts([fixt_blog_post])
+    app.comments.add(fixt_blog_comment)
+
+    with mock.patch.object(app.db, 'search') as m:
+        resp = await test_client_auth.get('/post/slug-1')
+
+    assert resp.status == 200
+    assert 'Hello Comment' in await resp.text()
+    assert m.call_count == 0
+
+
+def test_comment_index_page():
+    index = CommentIndex()
+    for i in range(5):
+        index.add(comment('a', str(i)))
+
+    def page(*args, **kwargs):
+        comments, cursor = index.page('a', *args, **kwargs)
+        return [x.content for x in comments], cursor
+
+    assert page(2) == (['4', '3'], 3)
+    assert page(2, before=3) == (['2', '1'], 1)
+    assert page(2, before=1) == (['0'], None)
+    assert page(2, before=10) == (['4', '3'], 3)
+    assert page(0) == (['4', '3', '2', '1', '0'], None)
+    assert index.page('b', 2) == ([], None)
+
+
+@pytest.mark.parametrize('config_overrides', [{'comments_page_size': 2}])
+async def test_post_comments_api(
+        test_client_no_auth, app, add_posts, fixt_blog_post,
+        fixt_blog_comment):
+    add_posts([fixt_blog_post])
+    for i in range(3):
+        app.comments.add(fixt_blog_comment._replace(content=str(i)))
+
+    resp = await test_client_no_auth.get('/post/slug-1/comments')
+    assert resp.status == 200
+    data = await resp.json()
+    assert [x['content'] for x in data['comments']] == ['2', '1']
+    assert data['comments'][0] == {
+        'author': 'Comment Author', 'content': '2',
+        'date': '2016-04-05T12:52:00', 'date_formatted': '05.04.2016 12:52',
+    }
+    assert data['next'] == 1
+
+    resp = await test_client_no_auth.get('/post/slug-1/comments?after=1')
+    data = await resp.json()
+    assert [x['content'] for x in data['comments']] == ['0']
+    assert data['next'] is None
+
+    resp = await test_client_no_auth.get('/post/slug-1/comments?after=x')
+    assert resp.status == 400
+    resp = await test_client_no_auth.get('/post/missing/comments')
+    assert resp.status == 404
+
+
+async def test_post_comments_api_invalidated(
+        test_client_no_auth, add_posts, fixt_blog_post):
+    add_posts([fixt_blog_post])
+
+    resp = await test_client_no_auth.get('/post/slug-1/comments')
+    assert (await resp.json())['comments'] == []
+
+    resp = await test_client_no_auth.post('/comment', json={
+        'name': 'Test', 'email': 'test@test.pl', 'message': 'Hello!',
+        'post_slug': 'slug-1',
+    })
+    assert resp.status == 204
+
+    resp = await test_client_no_auth.get('/post/slug-1/comments')
+    data = await resp.json()
+    assert [x['content'] for x in data['comments']] == ['Hello!']
+
+
+async def test_post_comments_api_disabled(
+        test_client_no_auth, add_posts, fixt_blog_post_comments_disabled):
+    add_posts([fixt_blog_post_comments_disabled])
+    resp = await test_client_no_auth.get('/post/slug-1/comments')
+    assert resp.status == 404
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import gzip
+import pytest
+import mock
+from app.compression import (
+    accepted_encoding, compress_file, compress_directory,
+    precompressed_files)
+
+
+def request(accept_encoding=None):
+    headers = {}
+    if accept_encoding is not None:
+        headers['Accept-Encoding'] = accept_encoding
+    return mock.Mock(headers=headers)
+
+
+@pytest.mark.parametrize('accept_encoding,expected', (
+    ('gzip, deflate, br', 'br'),
+    ('gzip, deflate', 'gzip'),
+    ('gzip;q=1.0, br;q=0.5', 'gzip'),
+    ('br;q=0, gzip;q=0.1', 'gzip'),
+    ('*', 'br'),
+    ('*, br;q=0', 'gzip'),
+    ('identity', None),
+    ('gzip;q=x', None),
+    (None, None),
+))
+def test_accepted_encoding(accept_encoding, expected):
+    assert accepted_encoding(
+        request(accept_encoding), ['br', 'gzip']) == expected
+
+
+def test_compress_file(tmpdir):
+    path = str(tmpdir.join('a.css'))
+    with open(path, 'w') as f:
+        f.write('body { color: red; }\n' * 100)
+
+    assert compress_file(path, ['gzip']) == [path + '.gz']
+    with gzip.open(path + '.gz', 'rt') as f:
+        assert f.read() == 'body { color: red; }\n' * 100
+    # up to date
+    assert compress_file(path, ['gzip']) == []
+
+    small = str(tmpdir.join('b.js'))
+    with open(small, 'w') as f:
+        f.write('x')
+    assert compress_file(small, ['gzip']) == []
+
+
+def test_compress_directory(tmpdir):
+    tmpdir.mkdir('css').join('a.css').write('a' * 2000)
+    tmpdir.join('b.png').write('b' * 2000)
+    tmpdir.join('c.js').write('c' * 10)
+    tmpdir.mkdir('node_modules').join('d.js').write('d' * 2000)
+
+    written = compress_directory(str(tmpdir))
+    assert str(tmpdir.join('css', 'a.css.gz')) in written
+    assert not any(
+        'b.png' in x or 'c.js' in x or 'node_modules' in x for x in written)
+
+
+def test_precompressed_files(tmpdir):
+    tmpdir.mkdir('css').join('a.css').write('a')
+    tmpdir.join('css', 'a.css.gz').write('gz')
+    tmpdir.join('css', 'a.css.br').write('br')
+    tmpdir.join('b.js').write('b')
+    tmpdir.mkdir('node_modules').join('d.js.gz').write('gz')
+    tmpdir.join('node_modules', 'd.js').write('d')
+
+    assert precompressed_files(str(tmpdir)) == {'css/a.css': {
+        'gzip': str(tmpdir.join('css', 'a.css.gz')),
+        'br': str(tmpdir.join('css', 'a.css.br')),
+    }}
+
+
+@pytest.fixture
+def static_path(tmpdir, app):
+    path = tmpdir.mkdir('static')
+    path.mkdir('css').join('clean-blog.css').write('a' * 2000)
+    compress_file(str(path.join('css', 'clean-blog.css')), ['gzip'])
+    app.static_path = str(path)
+    app.static_variants = precompressed_files(str(path))
+    return path
+
+
+async def test_static_precompressed(test_client_no_auth, static_path):
+    resp = await test_client_no_auth.get(
+        '/static/css/clean-blog.css?v=1',
+        headers={'Accept-Encoding': 'gzip'})
+    assert resp.status == 200
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Content-Type'] == 'text/css'
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert 'immutable' in resp.headers['Cache-Control']
+    assert await resp.text() == 'a' * 2000
+
+    # original file of the static directory
+    resp = await test_client_no_auth.get(
+        '/static/css/clean-blog.css', headers={'Accept-Encoding': 'br'})
+    assert resp.status == 200
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+
+    resp = await test_client_no_auth.get(
+        '/static/../app/__init__.py', headers={'Accept-Encoding': 'gzip'})
+    assert resp.status in (403, 404)
+
+
+async def test_static_unknown_files_not_remembered(
+        test_client_no_auth, static_path):
+    app = test_client_no_auth.server.app
+    for x in range(5):
+        resp = await test_client_no_auth.get(
+            '/static/missing-{}.css'.format(x),
+            headers={'Accept-Encoding': 'gzip'})
+        assert resp.status == 404
+    assert list(app.static_variants) == ['css/clean-blog.css']
+
+
+@pytest.fixture(params=['test_client_auth', 'test_client_no_auth'])
+def client(request, loop):
+    """Without authorization pages are served from the page cache"""
+    return request.getfixturevalue(request.param)
+
+
+async def test_pages_compressed(client, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+
+    for _ in range(2):
+        resp = await client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert resp.status == 200
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert resp.headers['Vary'] == 'Accept-Encoding'
+        assert 'Title 1' in await resp.text()
+
+    resp = await client.get('/', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in resp.headers
+    assert 'Title 1' in await resp.text()
+
+
+@pytest.mark.parametrize('config_overrides', [{'compress_min_size': 0}])
+async def test_pages_compression_disabled(test_client_no_auth):
+    resp = await test_client_no_auth.get(
+        '/', headers={'Accept-Encoding': 'gzip'})
+    assert resp.status == 200
+    assert 'Content-Encoding' not in resp.headers
+
+
+async def test_page_cache_keeps_compressed_variant(test_client_no_auth, app):
+    await test_client_no_auth.get('/', headers={'Accept-Encoding': 'gzip'})
+    page, = app.page_cache._pages.values()
+    assert gzip.decompress(page.variants['gzip']) == page.body
+    assert app.page_cache.size == page.size
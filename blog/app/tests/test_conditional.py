@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import re
+import pytest
+import mock
+from app import load_pages_version, pages_version
+from app.conditional import (
+    etag_matches, is_not_modified, format_http_date, make_etag)
+
+
+def request(**headers):
+    return mock.Mock(headers=headers)
+
+
+@pytest.mark.parametrize('if_none_match,expected', (
+    ('"a"', True),
+    ('W/"a"', True),
+    ('"b", "a"', True),
+    ('*', True),
+    ('"b"', False),
+    ('a', False),
+))
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches('"a"', if_none_match) is expected
+
+
+def test_is_not_modified():
+    etag = make_etag('x')
+    assert is_not_modified(request(**{'If-None-Match': etag}), etag, 10)
+    assert not is_not_modified(request(**{'If-None-Match': '"x"'}), etag)
+    assert not is_not_modified(request(), etag, 10)
+
+    since = format_http_date(100)
+    assert is_not_modified(request(**{'If-Modified-Since': since}), None, 100)
+    assert is_not_modified(
+        request(**{'If-Modified-Since': since}), None, 100.5)
+    assert not is_not_modified(
+        request(**{'If-Modified-Since': since}), None, 101)
+    assert not is_not_modified(
+        request(**{'If-Modified-Since': 'garbage'}), None, 100)
+    # If-None-Match wins over If-Modified-Since
+    assert not is_not_modified(request(**{
+        'If-None-Match': '"x"', 'If-Modified-Since': since}), etag, 100)
+
+
+@pytest.fixture(params=['test_client_auth', 'test_client_no_auth'])
+def client(request, loop):
+    """Without authorization pages are served from the page cache"""
+    return request.getfixturevalue(request.param)
+
+
+async def test_post_not_modified(client, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+
+    resp = await client.get('/post/slug-1')
+    assert resp.status == 200
+    etag = resp.headers['ETag']
+    assert 'Last-Modified' in resp.headers
+
+    resp = await client.get('/post/slug-1', headers={'If-None-Match': etag})
+    assert resp.status == 304
+    assert resp.headers['ETag'] == etag
+    assert await resp.read() == b''
+
+    resp = await client.get('/post/slug-2', headers={'If-None-Match': etag})
+    assert resp.status == 200
+
+
+async def test_post_modified_by_comment(client, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+
+    resp = await client.get('/post/slug-1')
+    etag = resp.headers['ETag']
+
+    resp = await client.post('/comment', json={
+        'name': 'Test', 'email': 'test@test.pl', 'message': 'Hello!',
+        'post_slug': 'slug-1',
+    })
+    assert resp.status == 204
+
+    resp = await client.get('/post/slug-1', headers={'If-None-Match': etag})
+    assert resp.status == 200
+    assert resp.headers['ETag'] != etag
+
+
+async def test_post_modified_by_deploy(
+        test_client_auth, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+    urls = ('/post/slug-1', '/')
+    etags = [(await test_client_auth.get(x)).headers['ETag'] for x in urls]
+
+    # e.g. templates changed
+    test_client_auth.server.app.pages_version = 'other'
+    for url, etag in zip(urls, etags):
+        resp = await test_client_auth.get(
+            url, headers={'If-None-Match': etag})
+        assert resp.status == 200
+        assert resp.headers['ETag'] != etag
+
+
+async def test_debug_notices_changed_files(
+        test_client_no_auth, app, tmpdir, add_posts, fixt_blog_post):
+    add_posts([fixt_blog_post])
+    static = tmpdir.mkdir('static')
+    static.join('a.css').write('a')
+    app.static_path = str(static)
+    load_pages_version(app)
+
+    resp = await test_client_no_auth.get('/post/slug-1')
+    etag = resp.headers['ETag']
+    assert len(app.page_cache) == 1
+
+    static.join('b.css').write('b')
+    with mock.patch('app.file_version') as m:
+        resp = await test_client_no_auth.get(
+            '/post/slug-1', headers={'If-None-Match': etag})
+    assert resp.status == 200
+    assert resp.headers['ETag'] != etag
+    assert m.cache_clear.call_count == 1
+
+
+def test_pages_version(tmpdir):
+    static = tmpdir.mkdir('static')
+    static.join('a.css').write('a')
+    version = pages_version(str(static))
+    assert pages_version(str(static)) == version
+
+    static.join('b.css').write('b')
+    assert pages_version(str(static)) != version
+
+    version = pages_version(str(static))
+    # packages of npm are not served
+    static.mkdir('node_modules').join('c.js').write('c')
+    assert pages_version(str(static)) == version
+
+
+async def test_listing_not_modified(client, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+
+    resp = await client.get('/')
+    assert resp.status == 200
+    last_modified = resp.headers['Last-Modified']
+
+    resp = await client.get(
+        '/', headers={'If-Modified-Since': last_modified})
+    assert resp.status == 304
+
+    resp = await client.get(
+        '/page/1', headers={'If-None-Match': resp.headers['ETag']})
+    assert resp.status == 304
+
+
+async def test_static_versioned_urls(test_client_no_auth):
+    resp = await test_client_no_auth.get('/')
+    data = await resp.text()
+    url = re.search(r'"(/static/css/clean-blog.css\?v=\w+)"', data).group(1)
+
+    resp = await test_client_no_auth.get(url)
+    assert resp.status == 200
+    assert 'immutable' in resp.headers['Cache-Control']
+
+    resp = await test_client_no_auth.get('/static/css/clean-blog.css')
+    assert resp.status == 200
+    assert 'Cache-Control' not in resp.headers
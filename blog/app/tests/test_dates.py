@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import pickle
+import pytest
+from datetime import datetime
+from app.dates import DISPLAY_FORMAT, Timestamp, format_date
+
+
+def test_timestamp():
+    date = Timestamp('2016-04-05T12:52:00')
+    assert date == '2016-04-05T12:52:00'
+    assert date.datetime == datetime(2016, 4, 5, 12, 52)
+    assert date.timestamp == date.datetime.timestamp()
+    assert Timestamp(date) is date
+    assert hash(date) == hash('2016-04-05T12:52:00')
+    assert str(date) == '2016-04-05T12:52:00'
+    assert pickle.loads(pickle.dumps(date)) == date
+    assert not hasattr(date, '__dict__')
+
+    with pytest.raises(ValueError):
+        Timestamp('2016-04-05')
+
+
+def test_format_date():
+    date = Timestamp('2016-04-05T12:52:00')
+    assert format_date(date, '%d.%m.%Y %H:%M') == '05.04.2016 12:52'
+    assert format_date(date, '%Y') == '2016'
+    assert date.strftime(DISPLAY_FORMAT) is date.strftime(DISPLAY_FORMAT)
+    assert format_date('2016-04-05T12:52:00', '%Y') == '2016'
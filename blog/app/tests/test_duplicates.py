@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import pytest
+from datetime import datetime, timedelta
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+from app.dates import DATE_FORMAT
+from app.duplicates import DuplicateIndex, comment_key, contact_key
+from app.views import Comment, Contact, to_tinydb
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keys():
+    assert comment_key('slug', 'A@b.c', ' Hi ') == comment_key(
+        'slug', 'a@b.c', 'Hi')
+    assert comment_key('slug', 'a@b.c', 'Hi') != comment_key(
+        'other', 'a@b.c', 'Hi')
+    assert comment_key('a', 'b', 'c') != contact_key('b', 'c')
+
+
+def test_duplicate_index_window():
+    clock = Clock()
+    index = DuplicateIndex(60, 100, clock=clock)
+    index.add(b'a')
+    clock.now += 30
+    index.add(b'b')
+    assert b'a' in index
+    assert b'c' not in index
+
+    clock.now += 31
+    assert b'a' not in index
+    assert b'b' in index
+    assert len(index) == 1
+
+
+def test_duplicate_index_max_size():
+    index = DuplicateIndex(60, 2, clock=Clock())
+    for key in (b'a', b'b', b'a', b'c'):
+        index.add(key)
+
+    assert b'a' not in index
+    assert b'b' in index
+    assert b'c' in index
+
+
+def test_duplicate_index_build():
+    now = datetime(2020, 1, 2, 12, 0)
+    old = (now - timedelta(hours=2)).strftime(DATE_FORMAT)
+    recent = (now - timedelta(minutes=5)).strftime(DATE_FORMAT)
+
+    db = TinyDB(storage=MemoryStorage)
+    db.insert(to_tinydb(Comment(
+        author='A', date=recent, content='Hi', email='a@b.c',
+        post_slug='slug')))
+    db.insert(to_tinydb(Comment(
+        author='A', date=old, content='Old', email='a@b.c',
+        post_slug='slug')))
+    db.insert(to_tinydb(Contact(
+        email='a@b.c', name='A', message='Hello', date=recent)))
+    db.insert({'type': 'contact', 'date': 'broken'})
+
+    index = DuplicateIndex.build(
+        db, 3600, 100, clock=lambda: now.timestamp())
+    assert len(index) == 2
+    assert comment_key('slug', 'a@b.c', 'Hi') in index
+    assert comment_key('slug', 'a@b.c', 'Old') not in index
+    assert contact_key('a@b.c', 'Hello') in index
+
+
+def comment(message='Message'):
+    return {
+        'post_slug': 'slug-1', 'name': 'Name', 'email': 'a@example.com',
+        'message': message}
+
+
+@pytest.mark.parametrize('config_overrides', [{'duplicate_window': 60}])
+async def test_duplicate_comments_dropped(
+        test_client_no_auth, fixt_blog_post, add_posts):
+    add_posts([fixt_blog_post])
+    app = test_client_no_auth.server.app
+
+    for data in (comment(), comment(), comment('Other')):
+        resp = await test_client_no_auth.post('/comment', json=data)
+        assert resp.status == 204
+
+    assert [x.content for x in app.comments.get('slug-1')] == [
+        'Message', 'Other']
+
+
+@pytest.mark.parametrize('config_overrides', [{'duplicate_window': 60}])
+async def test_duplicate_contacts_dropped(test_client_no_auth):
+    app = test_client_no_auth.server.app
+    data = {'name': 'Name', 'email': 'a@example.com', 'message': 'Hello'}
+
+    for _ in range(2):
+        resp = await test_client_no_auth.post('/contact', json=data)
+        assert resp.status == 204
+
+    await app.writer.flush()
+    assert len(app.db.search(lambda x: x['type'] == 'contact')) == 1
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import pytest
+from app.export import SiteExport, page_file, site_urls, MANIFEST_NAME
+
+
+@pytest.mark.parametrize('url,expected', (
+    ('/', 'index.html'),
+    ('/page/2', 'page/2/index.html'),
+    ('/post/slug-1', 'post/slug-1/index.html'),
+    ('/author/John%20Doe', 'author/John Doe/index.html'),
+))
+def test_page_file(url, expected):
+    assert page_file(url) == expected
+
+
+@pytest.mark.parametrize('url', (
+    '/tag/a%2Fb', '/tag/..', '/tag/%2E%2E', '/author/%2E%2E%2F%2E%2E',
+    '/tag/a%00',
+))
+def test_page_file_outside_of_page_directory(url):
+    with pytest.raises(ValueError):
+        page_file(url)
+
+
+@pytest.fixture
+def export(test_client_no_auth, tmpdir):
+    return SiteExport(test_client_no_auth, str(tmpdir.join('output')))
+
+
+def read(export, url):
+    with open(os.path.join(export.output, page_file(url))) as f:
+        return f.read()
+
+
+async def test_export(export, app, add_posts, fixt_blog_posts, posts_path):
+    add_posts(fixt_blog_posts)
+    urls = await site_urls(app)
+    assert sorted(urls) == [
+        '/', '/about', '/author/D', '/author/D/page/1', '/author/P',
+        '/author/P/page/1', '/contact', '/page/1', '/post/slug-1',
+        '/post/slug-2']
+
+    assert await export.export(urls) == (10, 0)
+    assert 'Title 2' in read(export, '/')
+    assert 'Test content 1' in read(export, '/post/slug-1')
+
+    # pages with entity tags are not rendered again
+    with open(os.path.join(export.output, MANIFEST_NAME)) as f:
+        pages = json.load(f)['pages']
+    assert pages['/post/slug-1'] is not None
+    assert pages['/about'] is None
+    assert await export.export(urls) == (0, 0)
+
+    os.remove(os.path.join(posts_path, 'slug-2.md'))
+    urls = await site_urls(app)
+    assert await export.export(urls) == (2, 3)
+    assert 'Title 2' not in read(export, '/')
+    assert not os.path.exists(os.path.join(export.output, 'post', 'slug-2'))
+
+
+async def test_export_fingerprint(export, app):
+    urls = await site_urls(app)
+    await export.export(urls)
+    os.remove(os.path.join(export.output, 'about', 'index.html'))
+
+    export.fingerprint = 'new templates'
+    assert await export.export(urls) == (1, 0)
+    assert 'About' in read(export, '/about')
+
+
+async def test_export_skips_unsafe_pages(
+        export, add_posts, fixt_blog_post, tmpdir):
+    add_posts([fixt_blog_post._replace(tags=['a/../../../escaped'])])
+    assert await export.export(
+        ['/', '/tag/a%2F..%2F..%2F..%2Fescaped']) == (1, 0)
+    assert not tmpdir.join('escaped').exists()
+    assert list(export.etags) == ['/']
+
+
+@pytest.mark.parametrize('config_overrides', [{
+    'memory_db': False, 'db_read_only': True, 'db_refresh_interval': 0}])
+async def test_export_reads_database_only(
+        loop, test_client, app, tmpdir, monkeypatch):
+    monkeypatch.setattr(app.config, 'log_db_name', str(tmpdir.join('db')))
+    monkeypatch.setattr(app.config, 'db_name', str(tmpdir.join('db.json')))
+    export = SiteExport(await test_client(app), str(tmpdir.join('output')))
+
+    await export.export(['/'])
+    assert app.db_follower is None
+    assert app.db.read_only
+    assert not tmpdir.join('db').exists()
+
+
+@pytest.mark.parametrize('config_overrides', [{'search_form': False}])
+async def test_export_without_search_form(export, app):
+    await export.export(['/'])
+    assert 'action="/search"' not in read(export, '/')
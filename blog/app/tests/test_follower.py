@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import pytest
+from tinydb import TinyDB
+from app.storage import LogDB
+from app.views import Comment, to_tinydb
+
+
+def comment(content):
+    return to_tinydb(Comment(
+        author='Other worker', date='2016-04-05T12:52:00', content=content,
+        email='a@a.pl', post_slug='slug-1'))
+
+
+@pytest.fixture
+def config_overrides(request, tmpdir):
+    return {
+        'memory_db': False, 'db_backend': request.param,
+        'log_db_name': str(tmpdir.join('db.jsonl')),
+        'db_name': str(tmpdir.join('db.json')),
+        'db_refresh_interval': 60,
+    }
+
+
+def other_worker_db(config):
+    if config.db_backend == 'log':
+        return LogDB(config.log_db_name)
+    return TinyDB(config.db_name)
+
+
+@pytest.mark.parametrize('config_overrides', ['log', 'tinydb'], indirect=True)
+async def test_comments_of_other_workers(
+        test_client_no_auth, fixt_blog_post, add_posts):
+    add_posts([fixt_blog_post])
+    app = test_client_no_auth.server.app
+    resp = await test_client_no_auth.get('/post/slug-1')
+    assert 'Other worker' not in await resp.text()
+
+    db = other_worker_db(app.config)
+    db.insert(comment('First'))
+    db.close()
+    await app.db_follower.check()
+
+    # the cached page is removed as well
+    resp = await test_client_no_auth.get('/post/slug-1')
+    assert 'First' in await resp.text()
+    assert [x.content for x in app.comments.get('slug-1')] == ['First']
+
+    await app.db_follower.check()
+    assert len(app.comments.get('slug-1')) == 1
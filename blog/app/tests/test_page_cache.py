@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+import mock
+from app.page_cache import PageCache, CachedPage
+from app.views import get_post_index
+
+
+def page(size):
+    return CachedPage(b'x' * size, 200, 'text/html', 'utf-8')
+
+
+def key(route, **params):
+    return (route, tuple(sorted(params.items())), '')
+
+
+def test_page_cache_lru():
+    cache = PageCache(100)
+    cache.set(key('/a'), page(40))
+    cache.set(key('/b'), page(40))
+    assert cache.get(key('/a')) is not None  # 'a' is used again
+
+    cache.set(key('/c'), page(40))
+    assert cache.get(key('/b')) is None
+    assert cache.get(key('/a')) is not None
+    assert cache.get(key('/c')) is not None
+    assert cache.size == 80
+
+    cache.set(key('/d'), page(101))  # too big
+    assert cache.get(key('/d')) is None
+
+
+def test_page_cache_invalidate():
+    cache = PageCache(100)
+    cache.set(key('/post/{slug}', slug='a'), page(1))
+    cache.set(key('/post/{slug}', slug='b'), page(1))
+    cache.set(key('/page/{page}', page='1'), page(1))
+    cache.set(key('/page/{page}', page='2'), page(1))
+
+    cache.invalidate('/post/{slug}', slug='a')
+    assert cache.get(key('/post/{slug}', slug='a')) is None
+    assert cache.get(key('/post/{slug}', slug='b')) is not None
+
+    cache.invalidate('/page/{page}')
+    assert len(cache) == 1
+
+
+def test_page_cache_stale_generation():
+    cache = PageCache(100)
+    generation = cache.generation
+    cache.invalidate('/')
+    cache.set(key('/'), page(1), generation=generation)
+    assert cache.get(key('/')) is None
+
+
+async def get_text(client, url):
+    resp = await client.get(url)
+    assert resp.status == 200
+    return await resp.text()
+
+
+async def test_page_cache_serves_anonymous(
+        test_client_no_auth, app, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+
+    with mock.patch('app.views.get_post_index', wraps=get_post_index) as m:
+        first = await get_text(test_client_no_auth, '/')
+        second = await get_text(test_client_no_auth, '/')
+
+    assert first == second
+    assert m.call_count == 1
+
+
+async def test_page_cache_skipped_with_authorization(
+        test_client_auth, app, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+
+    with mock.patch('app.views.get_post_index', wraps=get_post_index) as m:
+        await get_text(test_client_auth, '/')
+        await get_text(test_client_auth, '/')
+
+    assert m.call_count == 2
+    assert len(app.page_cache) == 0
+
+
+async def test_page_cache_comment_evicts_post(
+        test_client_no_auth, app, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+    await get_text(test_client_no_auth, '/')
+    await get_text(test_client_no_auth, '/post/slug-1')
+    await get_text(test_client_no_auth, '/post/slug-2')
+
+    resp = await test_client_no_auth.post('/comment', json={
+        'name': 'Commenter', 'email': 'test@test.pl', 'message': 'Hello!',
+        'post_slug': 'slug-1',
+    })
+    assert resp.status == 204
+
+    assert len(app.page_cache) == 2
+    assert 'Commenter' in await get_text(test_client_no_auth, '/post/slug-1')
+
+
+async def test_page_cache_post_change_evicts_listings(
+        test_client_no_auth, app, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+    await get_text(test_client_no_auth, '/post/slug-1')
+    await get_text(test_client_no_auth, '/post/slug-2')
+    await get_text(test_client_no_auth, '/about')
+    assert 'Title 1' in await get_text(test_client_no_auth, '/')
+
+    add_posts([fixt_blog_posts[0]._replace(title='Changed')])
+    os.utime(os.path.join(app.posts.path, 'slug-1.md'), ns=(0, 0))
+
+    data = await get_text(test_client_no_auth, '/')
+    assert 'Changed' in data
+    assert 'Title 1' not in data
+    # post 2 and about page were not touched
+    assert len(app.page_cache) == 3
+
+
+@pytest.mark.parametrize('config_overrides', [{'page_cache_size': 0}])
+async def test_page_cache_disabled(
+        test_client_no_auth, app, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+    await get_text(test_client_no_auth, '/')
+    assert app.page_cache is None
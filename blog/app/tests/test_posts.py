@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import os
+import asyncio
+import pytest
+import mock
+from concurrent.futures import ThreadPoolExecutor
+from app.posts import (
+    PostCatalog, PostIndex, Post, parse_post_options, read_post_header,
+    scan_posts)
+
+
+POSTS = {
+    'a.md': [
+        '# Title', '## Sub', '### 2016-03-03T11:22:00', '#### test-slug',
+        '##### image', '###### Author', '#######', 'Content 1',
+    ],
+    'b.md': [
+        '# Title 1', '## Sub 1', '### 2016-03-03T11:28:00',
+        '#### test-slug-1', '##### image', '###### Author 2', '#######',
+        'Content 2',
+    ],
+    'c.md': [
+        '# Title 2', '## Sub 2', '### 2016-03-03T11:25:00',
+        '#### test-slug-2', '#####', '###### Author 3', '#######',
+        'Content 3',
+    ],
+    'd.md': [
+        '# Title 3', '## Sub 3', '### 2016-03-03T12:25:00',
+        '#### test-slug-3', '#####', '###### Author 4',
+        '####### disable_comments', 'Content 4',
+    ],
+}
+
+
+def write_file(path, name, lines):
+    with open(os.path.join(path, name), 'w') as f:
+        f.write('\n'.join(lines))
+
+
+@pytest.fixture
+def catalog(posts_path):
+    for name, lines in POSTS.items():
+        write_file(posts_path, name, lines)
+    write_file(posts_path, 'efee', ['not a post'])
+    return PostCatalog(posts_path)
+
+
+async def test_catalog_posts(loop, catalog):
+    posts = (await catalog.get_index()).posts
+    assert len(posts) == 4
+    assert posts == [
+        Post(
+            title='Title 3', subtitle='Sub 3', date='2016-03-03T12:25:00',
+            slug='test-slug-3', author='Author 4', image='',
+            options={'disable_comments': True}, content='<p>Content 4</p>'),
+        Post(
+            title='Title 1', subtitle='Sub 1', date='2016-03-03T11:28:00',
+            slug='test-slug-1', author='Author 2', options={},
+            image='image', content='<p>Content 2</p>'),
+        Post(
+            title='Title 2', subtitle='Sub 2', date='2016-03-03T11:25:00',
+            slug='test-slug-2', author='Author 3', options={},
+            image='', content='<p>Content 3</p>'),
+        Post(
+            title='Title', subtitle='Sub', date='2016-03-03T11:22:00',
+            slug='test-slug', author='Author', options={},
+            image='image', content='<p>Content 1</p>'),
+    ]
+
+
+async def test_catalog_reparses_only_changed(loop, catalog, posts_path):
+    await catalog.refresh_async()
+
+    with mock.patch('app.posts.read_post_header') as m:
+        assert await catalog.refresh_async() is False
+        assert m.call_count == 0
+
+    lines = list(POSTS['a.md'])
+    lines[0] = '# Changed title'
+    write_file(posts_path, 'a.md', lines)
+    os.utime(os.path.join(posts_path, 'a.md'), ns=(0, 0))
+
+    with mock.patch(
+            'app.posts.read_post_header', wraps=read_post_header) as m:
+        assert await catalog.refresh_async() is True
+        m.assert_called_once_with(os.path.join(posts_path, 'a.md'))
+
+    assert catalog.current_index.posts[-1].title == 'Changed title'
+
+
+async def test_catalog_added_and_removed(loop, catalog, posts_path):
+    await catalog.refresh_async()
+
+    os.remove(os.path.join(posts_path, 'd.md'))
+    lines = list(POSTS['a.md'])
+    lines[3] = '#### new-slug'
+    write_file(posts_path, 'e.md', lines)
+
+    slugs = [x.slug for x in (await catalog.get_index()).posts]
+    assert 'test-slug-3' not in slugs
+    assert 'new-slug' in slugs
+    assert len(slugs) == 4
+
+
+async def test_catalog_skips_broken_post(loop, catalog, posts_path):
+    write_file(posts_path, 'broken.md', ['# Title only'])
+    lines = list(POSTS['a.md'])
+    lines[2] = '### yesterday'
+    write_file(posts_path, 'bad-date.md', lines)
+    assert len((await catalog.get_index()).posts) == 4
+
+
+async def test_catalog_missing_directory(loop, tmpdir):
+    catalog = PostCatalog(str(tmpdir.join('nope')))
+    assert (await catalog.get_index()).posts == []
+
+
+def test_parse_post_options():
+    assert parse_post_options('') == {}
+    assert parse_post_options('disable_comments') == {
+        'disable_comments': True}
+
+    options = parse_post_options('disable_comments, other')
+    assert options.disable_comments is True
+    assert options.other is True
+    assert options.missing is False
+    assert options == parse_post_options('other,disable_comments')
+    assert parse_post_options('other') is parse_post_options('other')
+    with pytest.raises(AttributeError):
+        options.__missing__
+
+
+def test_read_post_header_digest(posts_path):
+    write_file(posts_path, 'a.md', POSTS['a.md'])
+    file_path = os.path.join(posts_path, 'a.md')
+    digest = read_post_header(file_path)['digest']
+    assert read_post_header(file_path)['digest'] == digest
+
+    write_file(posts_path, 'a.md', POSTS['a.md'] + ['More content'])
+    assert read_post_header(file_path)['digest'] != digest
+
+
+async def test_catalog_index(loop, catalog):
+    index = await catalog.get_index()
+    assert index.get('test-slug-1').title == 'Title 1'
+    assert index.get('not-existing') is None
+    assert index.total_pages == 1
+    assert [x.slug for x in index.page(1)] == [
+        'test-slug-3', 'test-slug-1', 'test-slug-2', 'test-slug']
+    assert index.page(2) == []
+    # nothing changed, same snapshot
+    assert await catalog.get_index() is index
+
+
+async def test_post_index_pages(
+        loop, posts_path, add_posts, fixt_blog_posts_two_pages):
+    add_posts(fixt_blog_posts_two_pages)
+    posts = (await PostCatalog(posts_path).get_index()).posts
+
+    index = PostIndex(posts, 5)
+    assert index.total_pages == 2
+    assert index.page(0) == []
+    assert index.page(1) == posts[:5]
+    assert index.page(2) == posts[5:]
+    assert index.page(3) == []
+
+
+async def test_post_index_duplicated_slug(loop, catalog, posts_path):
+    lines = list(POSTS['a.md'])
+    lines[2] = '### 2000-01-01T00:00:00'
+    lines[3] = POSTS['b.md'][3]
+    write_file(posts_path, 'older.md', lines)
+
+    index = await catalog.get_index()
+    assert index.get('test-slug-1').title == 'Title 1'
+
+
+async def test_post_index_validators(loop, catalog, posts_path):
+    index = await catalog.get_index()
+    assert index.last_modified == max(
+        x.content.mtime for x in index.posts)
+
+    write_file(posts_path, 'a.md', POSTS['a.md'] + ['More content'])
+    assert (await catalog.get_index()).etag != index.etag
+
+
+async def test_catalog_renders_content_lazily(loop, catalog):
+    with mock.patch('app.posts.markdown') as m:
+        m.markdown.return_value = '<p>Content 2</p>'
+        post = (await catalog.get_index()).get('test-slug-1')
+        assert m.markdown.call_count == 0
+
+        assert str(post.content) == '<p>Content 2</p>'
+        assert post.content.html == '<p>Content 2</p>'
+        assert m.markdown.call_count == 1
+
+
+async def test_catalog_refresh_in_executor(loop, catalog):
+    with ThreadPoolExecutor(2) as executor:
+        index = await catalog.get_index(executor)
+        post = index.get('test-slug-1')
+        assert await post.content.render(executor) == '<p>Content 2</p>'
+
+    assert len(index.posts) == 4
+
+
+async def test_catalog_concurrent_refresh_is_shared(loop, catalog):
+    with ThreadPoolExecutor(2) as executor:
+        with mock.patch('app.posts.scan_posts', wraps=scan_posts) as m:
+            result = await asyncio.gather(
+                *[catalog.refresh_async(executor) for _ in range(3)])
+
+    assert result == [True, True, True]
+    assert m.call_count == 1
+
+
+async def test_catalog_change_during_refresh_is_loaded(
+        loop, catalog, posts_path):
+    scanned = asyncio.Event()
+    release = asyncio.Event()
+    refresh = catalog._refresh
+
+    async def slow_refresh(executor):
+        changed = await refresh(executor)
+        if not release.is_set():
+            scanned.set()
+            await release.wait()
+        return changed
+
+    with mock.patch.object(catalog, '_refresh', slow_refresh):
+        first = asyncio.ensure_future(catalog.refresh_async())
+        await scanned.wait()
+
+        # changed after the directory was scanned, e.g. inotify event
+        lines = list(POSTS['a.md'])
+        lines[0] = '# Changed title'
+        write_file(posts_path, 'a.md', lines)
+        os.utime(os.path.join(posts_path, 'a.md'), ns=(0, 0))
+        second = asyncio.ensure_future(catalog.refresh_async())
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, second)
+
+    assert catalog.current_index.posts[-1].title == 'Changed title'
+
+
+@pytest.mark.parametrize('config_overrides', [{'prerender_workers': 2}])
+async def test_prerender_at_startup(
+        test_client, app, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+    await test_client(app)
+
+    index = app.posts.current_index
+    for post in index.posts:
+        assert post.content.rendered
+    assert index.get('slug-2').content == '<p>Test content 2</p>'
+
+
+async def test_prerender_reports_failures(loop, catalog, posts_path):
+    await catalog.refresh_async()
+    os.remove(os.path.join(posts_path, 'a.md'))
+
+    assert await catalog.prerender() == (3, 1)
+
+
+async def test_read_post_header_tags(loop, posts_path):
+    lines = list(POSTS['a.md'])
+    lines.insert(7, '######## Python, asyncio,, python ')
+    write_file(posts_path, 'tags.md', lines)
+    catalog = PostCatalog(posts_path)
+
+    post, = (await catalog.get_index()).posts
+    assert post.tags == ('asyncio', 'python')
+    assert post.content == '<p>Content 1</p>'
+
+
+async def test_post_index_tags_and_authors(loop, catalog, posts_path):
+    for name in ('a.md', 'b.md'):
+        lines = list(POSTS[name])
+        lines[5] = '###### Author'
+        lines.insert(7, '######## tag')
+        write_file(posts_path, name, lines)
+
+    index = PostIndex((await catalog.get_index()).posts, page_size=1)
+    assert [[x.slug for x in page] for page in index.tags['tag']] == [
+        ['test-slug-1'], ['test-slug']]
+    assert [[x.slug for x in page] for page in index.authors['Author']] == [
+        ['test-slug-1'], ['test-slug']]
+    assert sorted(index.authors) == ['Author', 'Author 3', 'Author 4']
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import pytest
+from app.ratelimit import RateLimiter
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_burst_and_refill():
+    clock = Clock()
+    limiter = RateLimiter(0.5, 2, clock=clock)
+
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') == pytest.approx(2)
+    assert limiter.acquire('b') == 0
+
+    clock.now += 1
+    assert limiter.acquire('a') == pytest.approx(1)
+    clock.now += 1
+    assert limiter.acquire('a') == 0
+
+    # never more than the burst
+    clock.now += 100
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') > 0
+
+
+def test_rate_limiter_bounded_keys():
+    clock = Clock()
+    limiter = RateLimiter(0.1, 1, max_keys=2, clock=clock)
+
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('b') == 0
+    assert limiter.acquire('a') > 0  # 'a' is used recently now
+    assert limiter.acquire('c') == 0
+    assert len(limiter) == 2
+
+    assert limiter.acquire('a') > 0
+    assert limiter.acquire('b') == 0  # it was forgotten
+
+
+LIMITS = {
+    'rate_limit_client': 0.01, 'rate_limit_client_burst': 2,
+    'rate_limit_post': 0.01, 'rate_limit_post_burst': 3,
+}
+
+
+def comment(slug='slug-1'):
+    return {
+        'post_slug': slug, 'name': 'Name', 'email': 'a@example.com',
+        'message': 'Message'}
+
+
+@pytest.mark.parametrize('config_overrides', [LIMITS])
+async def test_client_rate_limit(
+        test_client_no_auth, fixt_blog_post, add_posts):
+    add_posts([fixt_blog_post])
+
+    for _ in range(2):
+        resp = await test_client_no_auth.post('/comment', json=comment())
+        assert resp.status == 204
+
+    resp = await test_client_no_auth.post('/contact', data='not JSON')
+    assert resp.status == 429
+    assert int(resp.headers['Retry-After']) == 100
+
+    app = test_client_no_auth.server.app
+    assert len(app.comments.get('slug-1')) == 2
+
+
+@pytest.mark.parametrize('config_overrides', [
+    dict(LIMITS, rate_limit_client=0)])
+async def test_post_rate_limit(
+        test_client_no_auth, fixt_blog_posts, add_posts):
+    add_posts(fixt_blog_posts)
+
+    for _ in range(3):
+        resp = await test_client_no_auth.post('/comment', json=comment())
+        assert resp.status == 204
+
+    resp = await test_client_no_auth.post('/comment', json=comment())
+    assert resp.status == 429
+    assert 'Retry-After' in resp.headers
+
+    resp = await test_client_no_auth.post(
+        '/comment', json=comment('slug-2'))
+    assert resp.status == 204
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import pytest
+import mock
+from app.render_cache import RenderCache
+from concurrent.futures import ProcessPoolExecutor
+from app.posts import PostCatalog, PostContent, render_markdown
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return RenderCache(str(tmpdir.join('cache')), 1024, config='test')
+
+
+def test_render_cache_miss_and_hit(cache):
+    render = mock.Mock(side_effect=render_markdown)
+
+    html, written = cache.render('Hello', render)
+    assert html == '<p>Hello</p>'
+    assert written == os.path.getsize(cache._file_path(cache.key('Hello')))
+    assert cache.render('Hello', render) == ('<p>Hello</p>', 0)
+    assert render.call_count == 1
+
+    assert cache.render('Other', render)[0] == '<p>Other</p>'
+    assert render.call_count == 2
+
+
+def test_render_cache_shared_between_instances(cache):
+    cache.render('Hello', render_markdown)
+
+    other = RenderCache(cache.path, cache.max_size, config='test')
+    assert other.get(other.key('Hello')) == '<p>Hello</p>'
+
+
+def test_render_cache_key_depends_on_config(cache):
+    other = RenderCache(cache.path, cache.max_size, config='other')
+    assert cache.key('Hello') != other.key('Hello')
+    assert cache.key('Hello') != cache.key('Hello!')
+
+
+def test_render_cache_broken_entry(cache):
+    key = cache.key('Hello')
+    cache.set(key, '<p>Hello</p>')
+    with open(cache._file_path(key), 'wb') as f:
+        f.write(b'garbage')
+
+    assert cache.get(key) is None
+    assert not os.path.exists(cache._file_path(key))
+
+
+def test_render_cache_evicts_least_recently_used(cache):
+    entries = [os.urandom(200).hex() for _ in range(3)]
+    cache.set('a', entries[0])
+    cache.set('b', entries[1])
+    os.utime(cache._file_path('a'), (1, 1))
+    os.utime(cache._file_path('b'), (2, 2))
+    # room for two entries only (compressed sizes differ by a few bytes)
+    cache.max_size = (50 + sum(
+        os.path.getsize(cache._file_path(x)) for x in ('a', 'b'))) / (
+            cache.LOW_WATER)
+    assert cache.get('a') == entries[0]  # 'a' is used again
+
+    cache.added(cache.set('c', entries[2]))
+
+    assert cache.get('a') == entries[0]
+    assert cache.get('b') is None
+    assert cache.get('c') == entries[2]
+
+
+def test_render_cache_scans_only_over_limit(cache):
+    cache.set('size', os.urandom(100).hex())
+    # room for about 50 entries
+    cache.max_size = 50 * os.path.getsize(cache._file_path('size'))
+    with mock.patch.object(
+            cache, '_entries', wraps=cache._entries) as entries:
+        for x in range(100):
+            cache.added(cache.set(str(x), os.urandom(100).hex()))
+        # not on every write, but when the limit is reached
+        assert 5 <= entries.call_count <= 15
+
+    total = directory_size(cache.path)
+    assert total == cache._size
+    assert total <= cache.max_size
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, x))
+               for x in os.listdir(path))
+
+
+async def test_render_cache_in_process_pool(loop, cache, tmpdir):
+    for x in range(20):
+        tmpdir.join('{}.md'.format(x)).write(
+            '\n' * 7 + os.urandom(400).hex())
+    contents = [
+        PostContent(str(tmpdir.join('{}.md'.format(x))), cache)
+        for x in range(20)]
+
+    cache.max_size = 4096
+    with ProcessPoolExecutor(2) as executor:
+        for content in contents:
+            await content.render(executor)
+
+    # writes of the pool are counted here, the directory stays bounded
+    assert cache._size == directory_size(cache.path)
+    assert cache._size <= cache.max_size
+
+
+def test_render_cache_copy_does_not_scan(cache):
+    copy = pickle.loads(pickle.dumps(cache))
+    with mock.patch.object(RenderCache, '_entries') as entries:
+        for x in range(10):
+            copy.render(str(x), render_markdown)
+    assert entries.call_count == 0
+
+
+async def test_catalog_uses_render_cache(
+        loop, posts_path, add_posts, fixt_blog_post):
+    add_posts([fixt_blog_post])
+    cache = RenderCache(os.path.join(posts_path, '.cache'), 1024)
+    for _ in range(2):
+        catalog = PostCatalog(posts_path, render_cache=cache)
+        with mock.patch(
+                'app.posts.render_markdown', wraps=render_markdown) as m:
+            index = await catalog.get_index()
+            assert index.get('slug-1').content == (
+                '<p>Test content 1</p>')
+    assert m.call_count == 0  # second catalog read it from the cache
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import mock
+from app.app import run_in_executor
+from app.search import SearchIndex, tokenize
+
+
+def test_tokenize():
+    assert tokenize('Hello, *World* of `asyncio`!') == [
+        'hello', 'world', 'of', 'asyncio']
+
+
+def test_search_ranks_by_relevance():
+    index = SearchIndex()
+    index.add('a', 'python tips and some other words about nothing')
+    index.add('b', 'python python python')
+    index.add('c', 'cooking')
+
+    assert index.search('python') == ['b', 'a']
+    # the rare term weighs more
+    assert index.search('Cooking python') == ['c', 'b', 'a']
+    assert index.search('missing') == []
+    assert index.search('') == []
+
+
+def test_search_phrase():
+    index = SearchIndex()
+    index.add('a', 'event loop of asyncio')
+    index.add('b', 'loop over events')
+
+    assert index.search('"event loop"') == ['a']
+    assert index.search('"loop event"') == []
+    assert sorted(index.search('loop event')) == ['a', 'b']
+
+
+def test_search_index_add_replaces_and_remove():
+    index = SearchIndex()
+    index.add('a', 'first version')
+    index.add('a', 'second version')
+
+    assert index.search('first') == []
+    assert index.search('second') == ['a']
+    assert index.total_length == 2
+
+    index.remove('a')
+    index.remove('a')
+    assert len(index) == 0
+    assert not index.postings
+    assert index.total_length == 0
+
+
+async def test_search_view(test_client_auth, fixt_blog_posts, add_posts):
+    add_posts(fixt_blog_posts)
+
+    resp = await test_client_auth.get('/search', params={'q': 'content 2'})
+    assert resp.status == 200
+    data = await resp.text()
+    assert '- Search: content 2' in data
+    assert '/post/slug-2' in data
+    assert '/post/slug-1' in data
+    assert data.index('/post/slug-2') < data.index('/post/slug-1')
+
+    resp = await test_client_auth.get('/search', params={'q': 'nothing'})
+    assert resp.status == 200
+    assert 'No posts match' in await resp.text()
+
+
+async def test_search_view_paginates(
+        test_client_auth, fixt_blog_posts_two_pages, add_posts):
+    add_posts(fixt_blog_posts_two_pages)
+
+    resp = await test_client_auth.get('/search', params={'q': 'content'})
+    data = await resp.text()
+    assert resp.status == 200
+    assert '/search?q=content&amp;page=2' in data
+    assert 'Newer Posts' not in data
+
+    resp = await test_client_auth.get(
+        '/search', params={'q': 'content', 'page': '2'})
+    data = await resp.text()
+    assert resp.status == 200
+    assert '/search?q=content&amp;page=1' in data
+    assert data.count('post-preview') == 1
+
+    resp = await test_client_auth.get(
+        '/search', params={'q': 'content', 'page': '3'})
+    assert resp.status == 404
+
+
+async def test_search_follows_changed_posts(
+        test_client_no_auth, fixt_blog_post, add_posts):
+    add_posts([fixt_blog_post])
+    resp = await test_client_no_auth.get('/search', params={'q': 'changed'})
+    assert 'No posts match' in await resp.text()
+
+    add_posts([fixt_blog_post._replace(content='Changed content')])
+    await test_client_no_auth.server.app.posts.refresh_async()
+
+    resp = await test_client_no_auth.get('/search', params={'q': 'changed'})
+    assert '/post/slug-1' in await resp.text()
+
+
+async def test_search_index_built_at_startup(
+        test_client, app, fixt_blog_posts, add_posts):
+    add_posts(fixt_blog_posts)
+    await test_client(app)
+    assert len(app.search) == 2
+
+
+async def test_search_reads_changed_posts_in_executor(
+        test_client_no_auth, fixt_blog_posts, add_posts):
+    app = test_client_no_auth.server.app
+    add_posts(fixt_blog_posts)
+
+    with mock.patch('app.search.run_in_executor',
+                    wraps=run_in_executor) as m:
+        # indexed in the background, before any search
+        await app.posts.refresh_async()
+        await app.search.refresh(app.posts)
+    assert m.call_count == 1
+    assert len(m.call_args[0][2]) == 2
+    assert len(app.search) == 2
+
+    resp = await test_client_no_auth.get('/search', params={'q': 'content'})
+    assert '/post/slug-1' in await resp.text()
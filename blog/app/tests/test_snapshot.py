@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+import mock
+from app.posts import PostCatalog, PostContent, render_post_file
+from app.snapshot import (
+    PostSnapshot, SnapshotContent, SnapshotStore, write_snapshot, SUFFIX)
+from app.tests.test_posts import POSTS, write_file
+
+
+def test_write_snapshot(tmpdir):
+    path = str(tmpdir.join('a' + SUFFIX))
+    write_snapshot(path, 'key', [
+        ('a.md', [1, 2, 3], {'slug': 'a'}, '<p>zażółć</p>'),
+        ('b.md', [4, 5, 6], {'slug': 'b'}, None),
+        ('c.md', [7, 8, 9], {'slug': 'c'}, '<p>c</p>'),
+    ])
+
+    snapshot = PostSnapshot(path)
+    assert snapshot.key == 'key'
+    a, b, c = snapshot.posts
+    assert a['header'] == {'slug': 'a'}
+    assert 'offset' not in b
+    body = snapshot.body(a['offset'], a['length'])
+    assert isinstance(body, memoryview)
+    assert str(body, 'utf-8') == '<p>zażółć</p>'
+    assert bytes(snapshot.body(c['offset'], c['length'])) == b'<p>c</p>'
+
+
+@pytest.fixture
+def store(tmpdir):
+    return SnapshotStore(str(tmpdir.join('snapshots')))
+
+
+@pytest.fixture
+def catalog(posts_path, store):
+    for name, lines in POSTS.items():
+        write_file(posts_path, name, lines)
+    return PostCatalog(posts_path, snapshots=store)
+
+
+async def test_catalog_from_snapshot(loop, catalog, store, posts_path):
+    index = await catalog.get_index()
+    assert len(index.posts) == 4
+    assert all(isinstance(x.content, SnapshotContent) for x in index.posts)
+    assert all(x.content.rendered for x in index.posts)
+    assert index.get('test-slug-1').content == '<p>Content 2</p>'
+    assert index.get('test-slug-3').options.disable_comments
+
+    # another worker maps the same snapshot without rendering
+    with mock.patch('app.snapshot.render_post_file') as m:
+        other = PostCatalog(posts_path, snapshots=store)
+        assert len((await other.get_index()).posts) == 4
+    assert m.call_count == 0
+    assert len(os.listdir(store.path)) == 2  # with the lock file
+
+
+async def test_snapshot_content_decoded_once(loop, catalog):
+    content = (await catalog.get_index()).get('test-slug-1').content
+    html = await content.render()
+    assert html == '<p>Content 2</p>'
+    assert await content.render() is html
+    assert str(content) is html
+
+    with mock.patch.object(content.snapshot, 'body') as body:
+        for _ in range(3):
+            assert content.html is html
+    assert body.call_count == 0
+
+
+async def test_catalog_snapshot_generations(
+        loop, catalog, store, posts_path):
+    await catalog.refresh_async()
+    listener = mock.Mock()
+    catalog.listeners.append(listener)
+    assert await catalog.refresh_async() is False
+
+    lines = list(POSTS['a.md'])
+    lines[-1] = 'Changed'
+    write_file(posts_path, 'a.md', lines)
+    os.remove(os.path.join(posts_path, 'b.md'))
+
+    with mock.patch(
+            'app.snapshot.render_post_file', wraps=render_post_file) as m:
+        assert await catalog.refresh_async() is True
+    # bodies of unchanged posts are copied from the previous snapshot
+    m.assert_called_once_with(os.path.join(posts_path, 'a.md'), None)
+    listener.assert_called_once_with({'test-slug', 'test-slug-1'})
+    index = catalog.current_index
+    assert index.get('test-slug').content == '<p>Changed</p>'
+    assert index.get('test-slug-1') is None
+    assert index.get('test-slug-2').content == '<p>Content 3</p>'
+    snapshots = [x for x in os.listdir(store.path) if x.endswith(SUFFIX)]
+    assert len(snapshots) == 1
+
+
+async def test_catalog_snapshot_failed_render(loop, catalog, posts_path):
+    with mock.patch(
+            'app.snapshot.render_post_file', side_effect=ValueError):
+        index = await catalog.get_index()
+    assert len(index.posts) == 4
+    assert all(type(x.content) is PostContent for x in index.posts)
+    assert index.get('test-slug').content == '<p>Content 1</p>'
+
+
+async def test_catalog_snapshot_broken(loop, catalog, store):
+    with mock.patch.object(store, 'build', side_effect=OSError):
+        index = await catalog.get_index()
+    assert len(index.posts) == 4
+    assert not any(
+        isinstance(x.content, SnapshotContent) for x in index.posts)
+
+
+@pytest.fixture
+def config_overrides(tmpdir):
+    return {'snapshot_path': str(tmpdir.join('snapshots'))}
+
+
+async def test_post_from_snapshot(
+        test_client_auth, app, add_posts, fixt_blog_post):
+    add_posts([fixt_blog_post])
+    resp = await test_client_auth.get('/post/slug-1')
+    assert resp.status == 200
+    assert 'Test content 1' in await resp.text()
+    assert isinstance(
+        app.posts.current_index.get('slug-1').content, SnapshotContent)
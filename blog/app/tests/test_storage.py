@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import mock
+import pytest
+import multiprocessing
+from tinydb import Query
+from app.storage import LogDB
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    return str(tmpdir.join('db.jsonl'))
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(x) for x in f]
+
+
+def test_log_db_insert_and_search(db_path):
+    db = LogDB(db_path)
+    assert db.insert({'type': 'comment', 'post_slug': 'a'}) == 1
+    assert db.insert_multiple([
+        {'type': 'comment', 'post_slug': 'b'},
+        {'type': 'contact', 'email': 'x'},
+    ]) == [2, 3]
+
+    q = Query()
+    assert db.search(q.type == 'comment') == [
+        {'type': 'comment', 'post_slug': 'a'},
+        {'type': 'comment', 'post_slug': 'b'},
+    ]
+    assert len(db) == 3
+    assert len(read_lines(db_path)) == 3  # appended, not rewritten
+    db.close()
+
+
+def test_log_db_reopen(db_path):
+    db = LogDB(db_path)
+    db.insert({'a': 1})
+    db.insert({'a': 2})
+    db.close()
+
+    db = LogDB(db_path)
+    assert db.all() == [{'a': 1}, {'a': 2}]
+    assert db.insert({'a': 3}) == 3
+    db.close()
+
+
+def test_log_db_remove_and_compact(db_path):
+    db = LogDB(db_path)
+    db.insert_multiple([{'a': x} for x in range(5)])
+    assert db.remove(Query().a < 2) == [1, 2]
+    assert len(read_lines(db_path)) == 7
+    db.close()
+
+    db = LogDB(db_path)  # compacted on open
+    assert db.all() == [{'a': x} for x in range(2, 5)]
+    assert [x['id'] for x in read_lines(db_path)] == [3, 4, 5]
+    db.close()
+
+
+def test_log_db_read_only(db_path, tmpdir):
+    db = LogDB(db_path)
+    db.insert_multiple([{'a': x} for x in range(3)])
+    db.remove(Query().a == 0)
+    db.close()
+    with open(db_path, 'rb') as f:
+        data = f.read()
+
+    db = LogDB(db_path, read_only=True)
+    assert db.all() == [{'a': 1}, {'a': 2}]
+    with pytest.raises(PermissionError):
+        db.insert({'a': 3})
+    with pytest.raises(PermissionError):
+        db.remove(Query().a == 1)
+    db.close()
+    # not compacted
+    with open(db_path, 'rb') as f:
+        assert f.read() == data
+
+    db = LogDB(str(tmpdir.join('missing.jsonl')), read_only=True)
+    assert db.all() == []
+    db.close()
+    assert not tmpdir.join('missing.jsonl').exists()
+
+
+def test_log_db_compacts_when_much_garbage(db_path):
+    db = LogDB(db_path)
+    db.insert_multiple([{'a': x} for x in range(100)])
+    db.remove(Query().a < 60)
+    assert len(read_lines(db_path)) == 40
+    db.close()
+
+
+def test_log_db_skips_torn_line(db_path):
+    db = LogDB(db_path)
+    db.insert({'a': 1})
+    db.close()
+    with open(db_path, 'a') as f:
+        f.write('{"id": 2, "doc": {"a"')
+
+    db = LogDB(db_path)
+    assert db.all() == [{'a': 1}]
+    assert len(read_lines(db_path)) == 1
+    db.close()
+
+
+def test_log_db_imports_tinydb(db_path, tmpdir):
+    tinydb_path = str(tmpdir.join('db.json'))
+    with open(tinydb_path, 'w') as f:
+        json.dump({'_default': {
+            '10': {'a': 10}, '2': {'a': 2},
+        }}, f)
+
+    db = LogDB(db_path, import_path=tinydb_path)
+    assert db.all() == [{'a': 2}, {'a': 10}]
+    assert db.insert({'a': 11}) == 11
+    db.close()
+
+    assert len(read_lines(db_path)) == 3
+
+
+def test_log_db_shared_by_processes(db_path):
+    first, second = LogDB(db_path), LogDB(db_path)
+    assert first.insert({'a': 1}) == 1
+    assert second.insert({'a': 2}) == 2  # sees the line of the first one
+    assert first.insert({'a': 3}) == 3
+    first.close()
+    second.close()
+
+    db = LogDB(db_path)
+    assert db.all() == [{'a': 1}, {'a': 2}, {'a': 3}]
+    db.close()
+
+
+def test_log_db_refresh(db_path):
+    first, second = LogDB(db_path), LogDB(db_path)
+    listener = mock.Mock()
+    second.listeners.append(listener)
+
+    first.insert_multiple([{'a': 1}, {'a': 2}])
+    assert second.refresh() == [{'a': 1}, {'a': 2}]
+    listener.assert_called_once_with([{'a': 1}, {'a': 2}])
+    assert second.refresh() == []
+    assert len(second) == 2
+
+    first.remove(Query().a == 1)
+    second.refresh()
+    assert second.all() == [{'a': 2}]
+    first.close()
+    second.close()
+
+
+def test_log_db_compacted_by_other_process(db_path):
+    first, second = LogDB(db_path), LogDB(db_path)
+    first.insert_multiple([{'a': x} for x in range(5)])
+    first.remove(Query().a < 3)
+    first.compact()
+
+    # the replaced file is loaded again, nothing is appended to the old one
+    assert second.insert({'a': 5}) == 6
+    listener = mock.Mock()
+    first.listeners.append(listener)
+    first.refresh()
+    listener.assert_called_once_with([{'a': 5}])
+    first.close()
+    second.close()
+
+    db = LogDB(db_path)
+    assert db.all() == [{'a': 3}, {'a': 4}, {'a': 5}]
+    db.close()
+
+
+def insert_many(db_path, count):
+    db = LogDB(db_path)
+    for x in range(count):
+        db.insert({'pid': os.getpid(), 'x': x})
+    db.close()
+
+
+def test_log_db_concurrent_processes(db_path):
+    processes = [
+        multiprocessing.Process(target=insert_many, args=(db_path, 50))
+        for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    ids = [x['id'] for x in read_lines(db_path)]
+    assert sorted(ids) == list(range(1, 201))
+    db = LogDB(db_path)
+    assert len(db) == 200
+    db.close()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+import jinja2
+import pytest
+import aiohttp_jinja2
+from app import TEMPLATES_PATH, template_environment
+
+
+@pytest.fixture
+def config_overrides(tmpdir):
+    compiled_path = str(tmpdir.join('compiled'))
+    env = template_environment(jinja2.FileSystemLoader(TEMPLATES_PATH))
+    env.compile_templates(compiled_path, extensions=['jinja2'], zip=None)
+    return {
+        'templates_compiled_path': compiled_path,
+        'templates_cache_path': str(tmpdir.join('bytecode')),
+    }
+
+
+async def test_compiled_templates(
+        test_client_auth, app, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+    loader = aiohttp_jinja2.get_env(app).loader
+    assert isinstance(loader, jinja2.ChoiceLoader)
+
+    resp = await test_client_auth.get('/')
+    assert resp.status == 200
+    assert 'Title 1' in await resp.text()
+
+    resp = await test_client_auth.get('/post/slug-1')
+    assert resp.status == 200
+
+
+async def test_compiled_templates_escape(
+        test_client_auth, add_posts, fixt_blog_post):
+    add_posts([fixt_blog_post])
+    resp = await test_client_auth.post('/comment', json={
+        'post_slug': 'slug-1', 'name': '<script>alert(1)</script>',
+        'email': 'a@example.com', 'message': '<b>bold</b>'})
+    assert resp.status == 204
+
+    resp = await test_client_auth.get('/post/slug-1')
+    data = await resp.text()
+    assert '<script>alert(1)</script>' not in data
+    assert '&lt;script&gt;alert(1)&lt;/script&gt;' in data
+    assert '&lt;b&gt;bold&lt;/b&gt;' in data
+
+
+async def test_templates_warmed_up(test_client_auth, app, config_overrides):
+    # templates are compiled on startup, before the first request
+    env = aiohttp_jinja2.get_env(app)
+    assert len(env.cache) == len(os.listdir(TEMPLATES_PATH))
+    # compiled modules are used, so there is nothing to put into cache
+    assert os.listdir(config_overrides['templates_cache_path']) == []
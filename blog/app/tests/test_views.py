@@ -1,65 +1,15 @@
 # -*- coding: utf-8 -*-
 import pytest
 import mock
+import aiohttp
 from datetime import datetime
 from tinydb import Query
 from functools import wraps
-from app.views import get_blog_posts, Post, to_tinydb
-
-
-@mock.patch('app.views.os')
-@mock.patch('app.views.open')
-def test_get_blog_posts(mock_open, mock_os):
-    mock_os.listdir.return_value = ['a.md', 'b.md', 'c.md', 'd.md', 'efee']
-    mock_open.return_value.__enter__.return_value.readlines.side_effect = [
-        [
-            'Title', 'Sub', '2016-03-03T11:22:00', 'test-slug', 'image',
-            'Author', '', 'Content 1'
-        ],
-        [
-            'Title 1', 'Sub 1', '2016-03-03T11:28:00', 'test-slug-1',
-            'image', 'Author 2', '', 'Content 2',
-        ],
-        [
-            'Title 2', 'Sub 2', '2016-03-03T11:25:00', 'test-slug-2',
-            '', 'Author 3', '', 'Content 3'
-        ],
-        [
-            'Title 3', 'Sub 3', '2016-03-03T12:25:00', 'test-slug-3',
-            '', 'Author 4', 'disable_comments', 'Content 4',
-        ],
-    ]
-
-    posts = get_blog_posts()
-    assert len(posts) == 4
-    assert posts == [
-        Post(
-            title='Title 3', subtitle='Sub 3', date='2016-03-03T12:25:00',
-            slug='test-slug-3', author='Author 4', image='',
-            options={'disable_comments': True}, content='<p>Content 4</p>'),
-        Post(
-            title='Title 1', subtitle='Sub 1', date='2016-03-03T11:28:00',
-            slug='test-slug-1', author='Author 2', options={},
-            image='image', content='<p>Content 2</p>'),
-        Post(
-            title='Title 2', subtitle='Sub 2', date='2016-03-03T11:25:00',
-            slug='test-slug-2', author='Author 3', options={},
-            image='', content='<p>Content 3</p>'),
-        Post(
-            title='Title', subtitle='Sub', date='2016-03-03T11:22:00',
-            slug='test-slug', author='Author', options={},
-            image='image', content='<p>Content 1</p>'),
-    ]
-
-    assert mock_os.listdir.call_count == 1
-    assert mock_open.call_count == 4
+from app.views import Post, to_tinydb, insert_comment
 
 
 async def test_index(test_client_auth):
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=[])
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.get('/')
+    resp = await test_client_auth.get('/')
 
     assert resp.status == 200
 
@@ -71,12 +21,11 @@ async def test_index(test_client_auth):
     assert 'Older Posts' not in data
 
 
-async def test_index_has_posts(test_client_auth, fixt_blog_posts):
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=fixt_blog_posts)
+async def test_index_has_posts(
+        test_client_auth, fixt_blog_posts, add_posts):
+    add_posts(fixt_blog_posts)
 
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.get('/')
+    resp = await test_client_auth.get('/')
 
     assert resp.status == 200
 
@@ -97,16 +46,22 @@ async def test_index_has_posts(test_client_auth, fixt_blog_posts):
     assert '/post/slug-2' in data
 
 
+async def test_index_does_not_render_posts(
+        test_client_auth, fixt_blog_posts, add_posts):
+    add_posts(fixt_blog_posts)
+
+    with mock.patch('app.posts.markdown') as m:
+        resp = await test_client_auth.get('/')
+
+    assert resp.status == 200
+    assert m.markdown.call_count == 0
+
+
 async def test_page_has_posts_from_first(
-        test_client_auth, fixt_blog_posts_two_pages):
-    mock_get_total_pages = mock.patch(
-        'app.views.get_total_pages', return_value=2)
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=fixt_blog_posts_two_pages)
+        test_client_auth, fixt_blog_posts_two_pages, add_posts):
+    add_posts(fixt_blog_posts_two_pages)
 
-    with mock_get_blog_posts as m:
-        with mock_get_total_pages as m:
-            resp = await test_client_auth.get('/page/1')
+    resp = await test_client_auth.get('/page/1')
 
     assert resp.status == 200
 
@@ -116,32 +71,27 @@ async def test_page_has_posts_from_first(
     assert 'Newer Posts' not in data
     assert 'Older Posts' in data
 
-    assert 'Title 1' in data
-    assert 'Sub 1' in data
-    assert '01.01.2010 11:11' in data
-    assert '/post/slug-1' in data
+    assert 'Title 6' in data
+    assert 'Sub 6' in data
+    assert '06.01.2010 11:11' in data
+    assert '/post/slug-6' in data
 
     assert 'Title 5' in data
     assert 'Sub 5' in data
     assert '05.01.2010 11:11' in data
     assert '/post/slug-5' in data
 
-    assert 'Title 6' not in data
-    assert 'Sub 6' not in data
-    assert '06.01.2010 11:11' not in data
-    assert '/post/slug-6' not in data
+    assert 'Title 1' not in data
+    assert 'Sub 1' not in data
+    assert '01.01.2010 11:11' not in data
+    assert '/post/slug-1' not in data
 
 
 async def test_page_has_posts_from_second(
-        test_client_auth, fixt_blog_posts_two_pages):
-    mock_get_total_pages = mock.patch(
-        'app.views.get_total_pages', return_value=2)
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=fixt_blog_posts_two_pages)
+        test_client_auth, fixt_blog_posts_two_pages, add_posts):
+    add_posts(fixt_blog_posts_two_pages)
 
-    with mock_get_blog_posts as m:
-        with mock_get_total_pages as m:
-            resp = await test_client_auth.get('/page/2')
+    resp = await test_client_auth.get('/page/2')
 
     assert resp.status == 200
 
@@ -152,27 +102,24 @@ async def test_page_has_posts_from_second(
     assert 'Newer Posts' in data
     assert 'Older Posts' not in data
 
-    assert 'Title 1' not in data
-    assert 'Sub 1' not in data
-    assert '01.01.2010 11:11' not in data
-    assert '/post/slug-1' not in data
+    assert 'Title 6' not in data
+    assert 'Sub 6' not in data
+    assert '06.01.2010 11:11' not in data
+    assert '/post/slug-6' not in data
 
     assert 'Title 5' not in data
     assert 'Sub 5' not in data
     assert '05.01.2010 11:11' not in data
     assert '/post/slug-5' not in data
 
-    assert 'Title 6' in data
-    assert 'Sub 6' in data
-    assert '06.01.2010 11:11' in data
-    assert '/post/slug-6' in data
+    assert 'Title 1' in data
+    assert 'Sub 1' in data
+    assert '01.01.2010 11:11' in data
+    assert '/post/slug-1' in data
 
 
 async def test_page_not_found(test_client_auth):
-    mock_get_total_pages = mock.patch(
-        'app.views.get_total_pages', return_value=1)
-    with mock_get_total_pages as m:
-        resp = await test_client_auth.get('/page/2')
+    resp = await test_client_auth.get('/page/2')
 
     assert resp.status == 404
 
@@ -181,11 +128,9 @@ async def test_page_not_found(test_client_auth):
     assert 'Error 404' in data
 
 
-async def test_blog_post(test_client_auth, fixt_blog_posts):
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=fixt_blog_posts)
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.get('/post/slug-1')
+async def test_blog_post(test_client_auth, fixt_blog_posts, add_posts):
+    add_posts(fixt_blog_posts)
+    resp = await test_client_auth.get('/post/slug-1')
 
     assert resp.status == 200
 
@@ -203,11 +148,10 @@ async def test_blog_post(test_client_auth, fixt_blog_posts):
     assert 'Send' in data
 
 
-async def test_blog_post_image(test_client_auth, fixt_blog_post_image):
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=[fixt_blog_post_image])
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.get('/post/slug-1')
+async def test_blog_post_image(
+        test_client_auth, fixt_blog_post_image, add_posts):
+    add_posts([fixt_blog_post_image])
+    resp = await test_client_auth.get('/post/slug-1')
 
     assert resp.status == 200
 
@@ -227,13 +171,11 @@ async def test_blog_post_image(test_client_auth, fixt_blog_post_image):
 
 
 async def test_blog_post_comments(
-        test_client_auth, app, fixt_blog_post, fixt_blog_comment):
-    app.db.insert(to_tinydb(fixt_blog_comment))
+        test_client_auth, app, fixt_blog_post, fixt_blog_comment, add_posts):
+    insert_comment(app, fixt_blog_comment)
 
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=[fixt_blog_post])
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.get('/post/slug-1')
+    add_posts([fixt_blog_post])
+    resp = await test_client_auth.get('/post/slug-1')
 
     assert resp.status == 200
 
@@ -250,13 +192,137 @@ async def test_blog_post_comments(
     assert 'john@doe.pl' not in data
 
 
+def add_comments(app, fixt_blog_comment, count):
+    for i in range(count):
+        insert_comment(app, fixt_blog_comment._replace(
+            content='Comment {}.'.format(i)))
+
+
+@pytest.mark.parametrize('config_overrides', [{'comments_page_size': 2}])
+async def test_blog_post_comment_pages(
+        test_client_no_auth, app, fixt_blog_post, fixt_blog_comment,
+        add_posts):
+    add_posts([fixt_blog_post])
+    add_comments(app, fixt_blog_comment, 5)
+
+    # from the newest comments
+    resp = await test_client_no_auth.get('/post/slug-1')
+    data = await resp.text()
+    assert data.index('Comment 4.') < data.index('Comment 3.')
+    assert 'Comment 2.' not in data
+    assert 'Newer Comments' not in data
+    assert '?comments=2' in data
+    assert 'data-cursor="3"' in data
+
+    resp = await test_client_no_auth.get('/post/slug-1?comments=3')
+    data = await resp.text()
+    assert 'Comment 0.' in data and 'Comment 1.' not in data
+    assert '?comments=2' in data
+    assert 'Older Comments' not in data
+
+    for page in ('0', '4', 'x'):
+        resp = await test_client_no_auth.get(
+            '/post/slug-1?comments=' + page)
+        assert resp.status == 404
+
+
+@pytest.mark.parametrize('config_overrides', [{
+    'comments_page_size': 0, 'stream_min_comments': 3,
+}])
+async def test_blog_post_streamed(
+        test_client_no_auth, app, fixt_blog_post, fixt_blog_comment,
+        add_posts):
+    add_posts([fixt_blog_post])
+    add_comments(app, fixt_blog_comment, 3)
+
+    resp = await test_client_no_auth.get('/post/slug-1')
+    assert resp.status == 200
+    assert resp.headers['Transfer-Encoding'] == 'chunked'
+    assert resp.headers['Content-Type'] == 'text/html; charset=utf-8'
+    assert 'ETag' in resp.headers
+    data = await resp.text()
+    assert 'Test content 1' in data
+    assert all('Comment {}.'.format(i) in data for i in range(3))
+    assert data.rstrip().endswith('</html>')
+
+    # the sent page is cached, next requests are not rendered again
+    assert len(app.page_cache) == 1
+    etag = resp.headers['ETag']
+    with mock.patch('app.views.stream_template') as m:
+        resp = await test_client_no_auth.get('/post/slug-1')
+        assert await resp.text() == data
+        assert 'Transfer-Encoding' not in resp.headers
+
+        resp = await test_client_no_auth.get(
+            '/post/slug-1', headers={'If-None-Match': etag})
+        assert resp.status == 304
+    assert m.call_count == 0
+
+
+async def test_blog_post_streamed_by_default(
+        test_client_no_auth, app, fixt_blog_post, fixt_blog_comment,
+        add_posts):
+    conf = app.config
+    add_posts([fixt_blog_post])
+    add_comments(app, fixt_blog_comment, conf.comments_page_size - 1)
+
+    resp = await test_client_no_auth.get('/post/slug-1')
+    assert 'Transfer-Encoding' not in resp.headers
+    await resp.read()
+
+    # a full page of comments
+    add_comments(app, fixt_blog_comment, 1)
+    app.page_cache.clear()
+    resp = await test_client_no_auth.get('/post/slug-1')
+    assert resp.headers['Transfer-Encoding'] == 'chunked'
+    assert 'Comment 0.' in await resp.text()
+
+
+@pytest.mark.parametrize('config_overrides', [{
+    'comments_page_size': 2, 'stream_min_comments': 200,
+}])
+async def test_blog_post_streamed_above_page_size(
+        test_client_no_auth, app, fixt_blog_post, fixt_blog_comment,
+        add_posts):
+    add_posts([fixt_blog_post])
+    add_comments(app, fixt_blog_comment, 3)
+
+    resp = await test_client_no_auth.get('/post/slug-1')
+    assert resp.headers['Transfer-Encoding'] == 'chunked'
+    await resp.read()
+
+    # the last page is not full
+    resp = await test_client_no_auth.get('/post/slug-1?comments=2')
+    assert 'Transfer-Encoding' not in resp.headers
+    await resp.read()
+
+
+@pytest.mark.parametrize('config_overrides', [{
+    'comments_page_size': 0, 'stream_min_comments': 1,
+}])
+async def test_blog_post_stream_broken(
+        test_client_no_auth, app, fixt_blog_post, fixt_blog_comment,
+        add_posts):
+    add_posts([fixt_blog_post])
+    # the first chunk is sent before the broken comment is rendered
+    long_comment = fixt_blog_comment._replace(content='x' * 20000)
+    broken_comment = fixt_blog_comment._replace(content=mock.Mock(
+        __str__=mock.Mock(side_effect=ValueError),
+        __html__=mock.Mock(side_effect=ValueError)))
+    app.comments.add(broken_comment)
+    app.comments.add(long_comment)
+
+    resp = await test_client_no_auth.get('/post/slug-1')
+    assert resp.status == 200
+    with pytest.raises(aiohttp.ClientPayloadError):
+        await resp.read()
+    assert len(app.page_cache) == 0
+
+
 async def test_blog_post_comments_disabled(
-        test_client_auth, fixt_blog_post_comments_disabled):
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts',
-        return_value=[fixt_blog_post_comments_disabled])
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.get('/post/slug-1')
+        test_client_auth, fixt_blog_post_comments_disabled, add_posts):
+    add_posts([fixt_blog_post_comments_disabled])
+    resp = await test_client_auth.get('/post/slug-1')
 
     assert resp.status == 200
 
@@ -274,10 +340,7 @@ async def test_blog_post_comments_disabled(
 
 
 async def test_blog_post_not_found(test_client_auth):
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=[])
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.get('/post/test-slug')
+    resp = await test_client_auth.get('/post/test-slug')
 
     assert resp.status == 404
 
@@ -318,6 +381,7 @@ async def test_contact_can_send(test_client_auth, app):
 
     assert resp.status == 204
 
+    await app.writer.flush()
     result = app.db.search(Query().type == 'contact')
     assert len(result) == 1
     assert result == [
@@ -366,7 +430,8 @@ async def test_contact_too_long_data(test_client_auth):
     assert 'Error 400' in data
 
 
-async def test_comment_can_send(test_client_auth, app, fixt_blog_post):
+async def test_comment_can_send(
+        test_client_auth, app, fixt_blog_post, add_posts):
     app.db.insert(to_tinydb(fixt_blog_post))
 
     send_data = {
@@ -376,16 +441,15 @@ async def test_comment_can_send(test_client_auth, app, fixt_blog_post):
         'post_slug': 'slug-1',
     }
 
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=[fixt_blog_post])
+    add_posts([fixt_blog_post])
     mock_datetime = mock.patch('app.views.datetime')
-    with mock_get_blog_posts as m:
-        with mock_datetime as md:
-            md.strftime.return_value = '2017-04-05T12:33:00'
-            resp = await test_client_auth.post('/comment', json=send_data)
+    with mock_datetime as md:
+        md.strftime.return_value = '2017-04-05T12:33:00'
+        resp = await test_client_auth.post('/comment', json=send_data)
 
     assert resp.status == 204
 
+    await app.writer.flush()
     result = app.db.search(Query().type == 'comment')
     assert result == [
         {
@@ -407,10 +471,7 @@ async def test_comment_not_existing_slug(test_client_auth):
         'post_slug': 'test-slug',
     }
 
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=[])
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.post('/comment', json=send_data)
+    resp = await test_client_auth.post('/comment', json=send_data)
 
     assert resp.status == 400
 
@@ -436,7 +497,7 @@ async def test_comment_invalid_data(test_client_auth):
 
 
 async def test_comment_too_long_data(
-        test_client_auth, app, fixt_blog_post):
+        test_client_auth, app, fixt_blog_post, add_posts):
     app.db.insert(to_tinydb(fixt_blog_post))
     send_data = {
         'name': 'Test' * 100,
@@ -445,13 +506,58 @@ async def test_comment_too_long_data(
         'post_slug': 'slug-1',
     }
 
-    mock_get_blog_posts = mock.patch(
-        'app.views.get_blog_posts', return_value=[fixt_blog_post])
-    with mock_get_blog_posts as m:
-        resp = await test_client_auth.post('/comment', json=send_data)
+    add_posts([fixt_blog_post])
+    resp = await test_client_auth.post('/comment', json=send_data)
 
     assert resp.status == 400
 
     data = await resp.content.read()
     data = data.decode('utf-8')
     assert 'Error 400' in data
+
+
+async def test_tag_and_author_pages(
+        test_client_auth, fixt_blog_posts_two_pages, add_posts):
+    posts = fixt_blog_posts_two_pages
+    posts = [x._replace(tags=('odd',), author='Jo Do') for x in posts[::2]]
+    add_posts(fixt_blog_posts_two_pages + posts)
+
+    resp = await test_client_auth.get('/tag/Odd')
+    assert resp.status == 200
+    data = await resp.text()
+    assert '- Tag: Odd' in data
+    assert '/post/slug-5' in data
+    assert '/post/slug-1' in data
+    assert '/post/slug-2' not in data
+    assert 'href="/tag/odd"' in data
+    assert 'Older Posts' not in data
+
+    resp = await test_client_auth.get('/author/Jo%20Do')
+    assert resp.status == 200
+    data = await resp.text()
+    assert '- Posts by Jo Do' in data
+    assert 'href="/author/Jo%20Do"' in data
+    assert data.count('post-preview') == 3
+
+    resp = await test_client_auth.get('/author/D/page/1')
+    assert resp.status == 200
+    assert '/post/slug-2' in await resp.text()
+
+    for url in ('/tag/missing', '/tag/odd/page/2', '/author/D/page/0'):
+        resp = await test_client_auth.get(url)
+        assert resp.status == 404
+
+
+async def test_tag_pages_follow_changed_posts(
+        test_client_no_auth, fixt_blog_post, add_posts):
+    add_posts([fixt_blog_post._replace(tags=('old',))])
+    resp = await test_client_no_auth.get('/tag/old')
+    assert resp.status == 200
+
+    add_posts([fixt_blog_post._replace(tags=('new',))])
+    await test_client_no_auth.server.app.posts.refresh_async()
+
+    resp = await test_client_no_auth.get('/tag/old')
+    assert resp.status == 404
+    resp = await test_client_no_auth.get('/tag/new')
+    assert resp.status == 200
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+import asyncio
+import pytest
+import mock
+from app.posts import PostCatalog
+from app.watcher import PostWatcher, Inotify
+
+
+def has_inotify(path):
+    try:
+        Inotify(path).close()
+        return True
+    except OSError:
+        return False
+
+
+async def wait_for(condition, timeout=2):
+    for _ in range(int(timeout / 0.02)):
+        if condition():
+            return True
+        await asyncio.sleep(0.02)
+    return False
+
+
+@pytest.fixture(params=['inotify', 'poll'])
+def watcher(request, loop, posts_path):
+    if request.param == 'inotify' and not has_inotify(posts_path):
+        pytest.skip('inotify is not available')
+
+    catalog = PostCatalog(posts_path)
+    loop.run_until_complete(catalog.refresh_async())
+    watcher = PostWatcher(catalog, mode=request.param, interval=0.05)
+    watcher.start()
+    yield watcher
+    loop.run_until_complete(watcher.stop())
+
+
+async def test_watcher_reloads_posts(
+        watcher, add_posts, posts_path, fixt_blog_posts):
+    catalog = watcher.catalog
+    assert catalog.current_index.posts == []
+
+    add_posts(fixt_blog_posts)
+    assert await wait_for(lambda: len(catalog.current_index.posts) == 2)
+
+    os.remove(os.path.join(posts_path, 'slug-1.md'))
+    assert await wait_for(lambda: len(catalog.current_index.posts) == 1)
+    assert catalog.current_index.get('slug-2') is not None
+
+
+async def test_watcher_requests_do_not_scan(
+        watcher, add_posts, fixt_blog_posts):
+    add_posts(fixt_blog_posts)
+    catalog = watcher.catalog
+    assert await wait_for(lambda: len(catalog.current_index.posts) == 2)
+
+    with mock.patch('app.posts.scan_posts') as m:
+        index = await catalog.get_index()
+        assert index.get('slug-1') is not None
+    assert m.call_count == 0
+
+
+async def test_watcher_stop_restores_auto_refresh(loop, posts_path):
+    catalog = PostCatalog(posts_path)
+    watcher = PostWatcher(catalog, mode='poll')
+    watcher.start()
+    assert catalog.auto_refresh is False
+
+    await watcher.stop()
+    assert catalog.auto_refresh is True
+
+
+async def test_watcher_falls_back_to_polling(loop, tmpdir):
+    catalog = PostCatalog(str(tmpdir.join('not-existing')))
+    watcher = PostWatcher(catalog, mode='auto')
+    watcher.start()
+    assert watcher.inotify is None
+    await watcher.stop()
+
+
+async def test_watcher_follows_replaced_directory(
+        loop, tmpdir, posts_path, add_posts, fixt_blog_posts):
+    if not has_inotify(posts_path):
+        pytest.skip('inotify is not available')
+    catalog = PostCatalog(posts_path)
+    watcher = PostWatcher(catalog, mode='inotify', interval=0.05)
+    watcher.start()
+
+    # a deploy moves the old directory away and puts a new one there
+    os.rename(posts_path, str(tmpdir.join('old')))
+    assert await wait_for(lambda: watcher._poller is not None)
+    os.mkdir(posts_path)
+    assert await wait_for(lambda: watcher.inotify is not None)
+    assert catalog.auto_refresh is False
+
+    add_posts(fixt_blog_posts)
+    assert await wait_for(lambda: len(catalog.current_index.posts) == 2)
+    await watcher.stop()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import threading
+import mock
+from concurrent.futures import ThreadPoolExecutor
+from app.writer import WriteBehindQueue
+
+
+async def test_writer_batches_by_size(loop):
+    db = mock.Mock()
+    writer = WriteBehindQueue(db, max_batch=3, max_delay=10)
+    writer.start()
+
+    for x in range(7):
+        writer.enqueue({'a': x})
+    await asyncio.sleep(0.01)
+
+    assert db.insert_multiple.call_args_list == [
+        mock.call([{'a': 0}, {'a': 1}, {'a': 2}]),
+        mock.call([{'a': 3}, {'a': 4}, {'a': 5}]),
+        mock.call([{'a': 6}]),
+    ]
+    assert writer.depth == 0
+    await writer.close()
+
+
+async def test_writer_batches_by_delay(loop):
+    db = mock.Mock()
+    writer = WriteBehindQueue(db, max_batch=100, max_delay=0.05)
+    writer.start()
+
+    writer.enqueue({'a': 1})
+    writer.enqueue({'a': 2})
+    await asyncio.sleep(0.01)
+    assert db.insert_multiple.call_count == 0
+    assert writer.depth == 2
+
+    await asyncio.sleep(0.1)
+    db.insert_multiple.assert_called_once_with([{'a': 1}, {'a': 2}])
+    assert writer.written == 2
+    await writer.close()
+
+
+async def test_writer_close_flushes(loop):
+    db = mock.Mock()
+    writer = WriteBehindQueue(db, max_batch=100, max_delay=10)
+    writer.start()
+
+    writer.enqueue({'a': 1})
+    await writer.close()
+
+    db.insert_multiple.assert_called_once_with([{'a': 1}])
+
+
+async def test_writer_keeps_documents_on_error(loop):
+    db = mock.Mock()
+    db.insert_multiple.side_effect = [OSError('disk full'), None]
+    writer = WriteBehindQueue(db, max_batch=100, max_delay=0.01)
+    writer.start()
+
+    writer.enqueue({'a': 1})
+    await asyncio.sleep(0.1)
+
+    assert db.insert_multiple.call_count == 2
+    assert writer.depth == 0
+    await writer.close()
+
+
+async def test_writer_writes_in_executor(loop):
+    threads = []
+    db = mock.Mock()
+    db.insert_multiple.side_effect = lambda x: threads.append(
+        threading.get_ident())
+    with ThreadPoolExecutor(1) as executor:
+        writer = WriteBehindQueue(db, max_delay=0.01, executor=executor)
+        writer.start()
+        writer.enqueue({'a': 1})
+        await writer.close()
+
+    assert threads and threads[0] != threading.get_ident()
+    assert writer.written == 1
+
+
+async def test_writer_reports_depth(loop, caplog):
+    db = mock.Mock()
+    writer = WriteBehindQueue(
+        db, max_batch=100, max_delay=0.02, stats_interval=0.05)
+    writer.start()
+
+    with caplog.at_level(logging.INFO, logger='app.writer'):
+        for x in range(3):
+            writer.enqueue({'a': x})
+        await asyncio.sleep(0.06)
+        assert caplog.messages == [
+            'Write queue depth 0 (max 3), 3 documents written']
+
+        # nothing to report without writes
+        await asyncio.sleep(0.05)
+        assert len(caplog.messages) == 1
+    await writer.close()
+
+
+async def test_app_shutdown_flushes_writer(
+        test_client_no_auth, app, add_posts, fixt_blog_post):
+    add_posts([fixt_blog_post])
+    resp = await test_client_no_auth.post('/comment', json={
+        'name': 'Test', 'email': 'test@test.pl', 'message': 'Hello!',
+        'post_slug': 'slug-1',
+    })
+    assert resp.status == 204
+    assert app.writer.depth == 1
+
+    await test_client_no_auth.close()
+    assert app.writer.depth == 0
+    assert len(app.db.all()) == 1
@@ -1,24 +1,26 @@
 # -*- coding: utf-8 -*-
-import os
 import json
 import logging
-import markdown
 
+from urllib.parse import quote
 from functools import wraps
-from math import ceil
 from collections import namedtuple
 from aiohttp import web
 from aiohttp_jinja2 import template
 from datetime import datetime
-from tinydb import Query
+from .dates import DATE_FORMAT, DISPLAY_FORMAT, Timestamp
+from .app import is_int, json_response, stream_template
+from .posts import (  # noqa
+    Post, parse_post_options, post_timestamp, split_pages)
+from .page_cache import cache_page
+from .ratelimit import rate_limited, check_rate_limit
+from .duplicates import comment_key, contact_key, DOCUMENT_KEYS
+from .conditional import make_etag, conditional_response
 
 
 logger = logging.getLogger(__name__)
 
 
-Post = namedtuple('Post', [
-    'title', 'subtitle', 'date', 'author', 'slug',
-    'options', 'content', 'image'])
 Comment = namedtuple(
     'Comment', ['author', 'date', 'content', 'email', 'post_slug'])
 Contact = namedtuple(
@@ -36,6 +38,8 @@ def require_tinydb_conn(f):
 
 def to_tinydb(obj):
     ret = obj._asdict()
+    if isinstance(ret.get('date'), Timestamp):
+        ret['date'] = str(ret['date'])
     ret['type'] = type(obj).__name__.lower()
     return ret
 
@@ -43,6 +47,8 @@ def to_tinydb(obj):
 def from_tinydb(dict_):
     dict_ = dict(dict_)  # make clone of obj
     type_ = dict_.pop('type').title()
+    if 'date' in dict_:
+        dict_['date'] = Timestamp(dict_['date'])
     klass = globals()[type_](**dict_)
     return klass
     pass
@@ -53,120 +59,219 @@ def first(collection, *, default=None):
 
 
 PAGE_SIZE = 5
+# listings of posts by tag and author, removed from page cache on change
+LISTING_ROUTES = (
+    '/tag/{tag}', '/tag/{tag}/page/{page}',
+    '/author/{author}', '/author/{author}/page/{page}',
+)
 
 
-def get_total_pages():
-    posts_path = os.path.join(os.path.dirname(__file__), '..', 'posts')
-    files = os.listdir(posts_path)
-    return ceil(len(files) / PAGE_SIZE)
+async def get_post_index(app):
+    return await app.posts.get_index(app.executor)
 
 
-def parse_post_options(options_str):
-    class Settings():
-        def __init__(self, **kwargs):
-            self.__dict__ = kwargs
+def invalidate_post_pages(app, slugs):
+    if app.page_cache is None:
+        return
 
-        def __eq__(self, other):
-            if isinstance(other, dict):
-                return self.__dict__ == other
-            return self.__dict__ == other.__dict__
+    app.page_cache.invalidate('/')
+    app.page_cache.invalidate('/page/{page}')
+    app.page_cache.invalidate('/search')
+    for route in LISTING_ROUTES:
+        app.page_cache.invalidate(route)
+    for slug in slugs:
+        invalidate_comment_pages(app, slug)
 
-        def __neq__(self, other):
-            return not self.__eq__(other)
 
-    settings = Settings()
+def invalidate_comment_pages(app, slug):
+    if app.page_cache is not None:
+        app.page_cache.invalidate('/post/{slug}', slug=slug)
+        app.page_cache.invalidate('/post/{slug}/comments', slug=slug)
 
-    if not options_str:
-        return settings
 
-    options_list = options_str.split(',')
-    for option in options_list:
-        setattr(settings, option, True)
+def get_post_comments(app, post_slug):
+    return app.comments.get(post_slug)
 
-    return settings
 
+def insert_comment(app, comment):
+    app.writer.enqueue(to_tinydb(comment))
+    app.comments.add(comment)
 
-def get_blog_posts():
-    ret = []
 
-    posts_path = os.path.join(os.path.dirname(__file__), '..', 'posts')
-    files = os.listdir(posts_path)
-    for file_ in files:
-        if not file_.endswith('.md'):
-            continue
-        file_path = os.path.join(posts_path, file_)
-        with open(file_path) as f:
-            file_content = f.readlines()
-            title, subtitle, date, slug, image, author, options, *content = (
-                file_content)
-            html_content = markdown.markdown('\n'.join(content))
+def index_documents(app, documents):
+    """Index comments and contact messages written by other workers"""
+    for document in documents:
+        if app.duplicates is not None:
+            app.duplicates.add(
+                DOCUMENT_KEYS[document['type']](document),
+                Timestamp(document['date']).timestamp)
+        if document['type'] == 'comment':
+            comment = from_tinydb(document)
+            app.comments.add(comment)
+            invalidate_comment_pages(app, comment.post_slug)
 
-            title = title.strip('#').strip()
-            subtitle = subtitle.strip('#').strip()
-            date = date.strip('#').strip()
-            slug = slug.strip('#').strip()
-            image = image.strip('#').strip()
-            author = author.strip('#').strip()
-            options = options.strip('#').strip()
 
-            ret.append(Post(
-                title=title, subtitle=subtitle, date=date, slug=slug,
-                author=author, options=parse_post_options(options),
-                image=image, content=html_content))
+def invalidate_all_comment_pages(app):
+    if app.page_cache is not None:
+        app.page_cache.invalidate('/post/{slug}')
+        app.page_cache.invalidate('/post/{slug}/comments')
 
-    def sort_by_date(post):
-        x = datetime.strptime(post.date, '%Y-%m-%dT%H:%M:%S')
-        return x
 
-    ret.sort(key=sort_by_date, reverse=True)
-    return ret
+def is_duplicate(app, key):
+    """True if the same content was already sent recently"""
+    return app.duplicates is not None and key in app.duplicates
 
 
-def get_blog_posts_paginated(*, page=1):
-    start = (page - 1) * PAGE_SIZE
-    end = page * PAGE_SIZE
-    posts = get_blog_posts()
-    return posts[start:end]
+def remember_submission(app, key):
+    if app.duplicates is not None:
+        app.duplicates.add(key)
 
 
-def get_post_comments(app, post_slug):
-    q = Query()
-    result = app.db.search((q.type == 'comment') & (q.post_slug == post_slug))
-    return [from_tinydb(x) for x in result]
+def count_comment_pages(comments, page_size):
+    if not page_size:
+        return 1
+    return max(1, -(-len(comments) // page_size))
+
+
+def comment_to_json(comment):
+    return {
+        'author': comment.author, 'content': comment.content,
+        'date': str(comment.date),
+        'date_formatted': comment.date.strftime(DISPLAY_FORMAT),
+    }
+
+
+def listing_validators(app, index):
+    return {
+        'etag': make_etag('listing', app.pages_version, index.etag),
+        'last_modified': index.last_modified,
+    }
+
+
+def listing_page(request, index, pages, page, **context):
+    """Context of index.jinja2 with a page of `pages`, or Not Modified"""
+    if page > len(pages) or page < 1:
+        raise web.HTTPNotFound()
 
+    not_modified = conditional_response(
+        request, **listing_validators(request.app, index))
+    if not_modified is not None:
+        return not_modified
 
+    context.update(
+        posts=pages[page - 1], page=page, total_pages=len(pages))
+    return context
+
+
+def comment_revision(comments):
+    """Count of comments and date of the newest one"""
+    return (len(comments), comments[-1].date if comments else '')
+
+
+def post_validators(app, post, comments):
+    last_modified = post_timestamp(post)
+    if comments:
+        last_modified = max(last_modified, comments[-1].date.timestamp)
+
+    return {
+        'etag': make_etag(
+            'post', app.pages_version, post.content.digest,
+            *comment_revision(comments)),
+        'last_modified': last_modified,
+    }
+
+
+@cache_page
 @template('index.jinja2')
 @require_tinydb_conn
 async def handle_index(request, conn):
-    total_pages = get_total_pages()
-    posts = get_blog_posts_paginated()
+    index = await get_post_index(request.app)
+    not_modified = conditional_response(
+        request, **listing_validators(request.app, index))
+    if not_modified is not None:
+        return not_modified
+
     return {
-        'posts': posts, 'page': 1, 'total_pages': total_pages,
+        'posts': index.page(1), 'page': 1, 'total_pages': index.total_pages,
         'title': 'Index'
     }
 
 
+@cache_page
 @template('index.jinja2')
 @require_tinydb_conn
 async def handle_page(request, conn):
     page = int(request.match_info.get('page'))
-    total_pages = get_total_pages()
+    index = await get_post_index(request.app)
+    total_pages = index.total_pages
     if page > total_pages or page < 1:
         raise web.HTTPNotFound()
 
-    posts = get_blog_posts_paginated(page=page)
+    not_modified = conditional_response(
+        request, **listing_validators(request.app, index))
+    if not_modified is not None:
+        return not_modified
+
+    posts = index.page(page)
     return {
         'posts': posts, 'page': page, 'total_pages': total_pages,
         'title': 'Page {} of {}'.format(page, total_pages),
     }
 
 
+@cache_page
+@template('index.jinja2')
+@require_tinydb_conn
+async def handle_search(request, conn):
+    query = request.query.get('q', '').strip()
+    page = request.query.get('page', '1')
+    if not is_int(page):
+        raise web.HTTPNotFound()
+
+    index = await get_post_index(request.app)
+    await request.app.search.refresh(request.app.posts, request.app.executor)
+    posts = [index.get(x) for x in request.app.search.search(query)]
+    posts = [x for x in posts if x is not None]
+    return listing_page(
+        request, index, split_pages(posts, PAGE_SIZE) or [[]], int(page),
+        query=query, page_url='/search?q=' + quote(query) + '&page={}',
+        title='Search: {}'.format(query))
+
+
+@cache_page
+@template('index.jinja2')
+@require_tinydb_conn
+async def handle_tag(request, conn):
+    tag = request.match_info['tag']
+    page = int(request.match_info.get('page', 1))
+    index = await get_post_index(request.app)
+    return listing_page(
+        request, index, index.tags.get(tag.lower(), []), page,
+        page_url='/tag/' + quote(tag.lower(), safe='') + '/page/{}',
+        title='Tag: {}'.format(tag))
+
+
+@cache_page
+@template('index.jinja2')
+@require_tinydb_conn
+async def handle_author(request, conn):
+    author = request.match_info['author']
+    page = int(request.match_info.get('page', 1))
+    index = await get_post_index(request.app)
+    return listing_page(
+        request, index, index.authors.get(author, []), page,
+        page_url='/author/' + quote(author, safe='') + '/page/{}',
+        title='Posts by {}'.format(author))
+
+
+@cache_page
 @template('contact.jinja2')
 @require_tinydb_conn
 async def handle_contact(request, conn):
     return {'title': 'Contact'}
 
 
+@rate_limited
 @require_tinydb_conn
 async def handle_contact_form(request, conn):
     MAX_LEN = 1000
@@ -186,33 +291,110 @@ async def handle_contact_form(request, conn):
     if any([True for x in (name, email, message) if len(x) > MAX_LEN]):
         raise web.HTTPBadRequest()
 
-    date = datetime.strftime(datetime.now(), '%Y-%m-%dT%H:%M:%S')
+    key = contact_key(email, message)
+    if is_duplicate(request.app, key):
+        # answered as if it was stored, e.g. the button clicked twice
+        return web.Response(status=204)
+
+    date = datetime.strftime(datetime.now(), DATE_FORMAT)
     contact = Contact(
         email=email, name=name, message=message, date=date)
-    request.app.db.insert(to_tinydb(contact))
+    request.app.writer.enqueue(to_tinydb(contact))
+    remember_submission(request.app, key)
     return web.Response(status=204)
 
 
+@cache_page
 @template('about.jinja2')
 @require_tinydb_conn
 async def handle_about(request, conn):
     return {'title': 'About'}
 
 
+def should_stream(conf, page_comments):
+    """Threshold above the page size would never be reached otherwise"""
+    if not conf.stream_min_comments:
+        return False
+    threshold = conf.stream_min_comments
+    if conf.comments_page_size:
+        threshold = min(threshold, conf.comments_page_size)
+    return len(page_comments) >= threshold
+
+
+@cache_page
 @template('blog_post.jinja2')
 @require_tinydb_conn
 async def handle_blog_post(request, conn):
     slug = request.match_info.get('slug')
 
-    posts = get_blog_posts()
-    post = first([x for x in posts if x.slug == slug])
+    index = await get_post_index(request.app)
+    post = index.get(slug)
     if not post:
         raise web.HTTPNotFound()
 
+    conf = request.app.config
     comments = get_post_comments(request.app, post.slug)
-    return {'post': post, 'comments': comments, 'title': post.title}
+    page = request.query.get('comments', '1')
+    total_pages = count_comment_pages(comments, conf.comments_page_size)
+    if not is_int(page) or not 1 <= int(page) <= total_pages:
+        raise web.HTTPNotFound()
+    page = int(page)
+
+    not_modified = conditional_response(
+        request, **post_validators(request.app, post, comments))
+    if not_modified is not None:
+        return not_modified
+
+    await post.content.render(request.app.executor)
+    page_size = conf.comments_page_size
+    page_comments, cursor = request.app.comments.page(
+        post.slug, page_size, before=len(comments) - (page - 1) * page_size)
+    context = {
+        'post': post, 'comments': page_comments, 'comment_page': page,
+        'comment_pages': total_pages, 'comments_cursor': cursor,
+        'title': post.title,
+    }
+    if should_stream(conf, page_comments):
+        # send the article while comments are still rendered
+        return await stream_template(
+            'blog_post.jinja2', request, context,
+            compress=bool(conf.compress_min_size))
+    return context
 
 
+@cache_page
+@require_tinydb_conn
+async def handle_post_comments(request, conn):
+    """Older comments of the post, after the cursor of the previous page"""
+    slug = request.match_info.get('slug')
+
+    index = await get_post_index(request.app)
+    post = index.get(slug)
+    if not post or post.options.disable_comments:
+        raise web.HTTPNotFound()
+
+    after = request.query.get('after')
+    if after is not None and not (is_int(after) and int(after) >= 0):
+        raise web.HTTPBadRequest()
+
+    comments = get_post_comments(request.app, post.slug)
+    not_modified = conditional_response(request, **{
+        'etag': make_etag('comments', *comment_revision(comments)),
+        'last_modified': comments[-1].date.timestamp if comments else None,
+    })
+    if not_modified is not None:
+        return not_modified
+
+    page_comments, cursor = request.app.comments.page(
+        post.slug, request.app.config.comments_page_size,
+        before=None if after is None else int(after))
+    return json_response({
+        'comments': [comment_to_json(x) for x in page_comments],
+        'next': cursor,
+    })
+
+
+@rate_limited
 @require_tinydb_conn
 async def handle_blog_post_comment(request, conn):
     MAX_LEN = 1000
@@ -231,17 +413,26 @@ async def handle_blog_post_comment(request, conn):
     slug, name, email, message = (
         data['post_slug'], data['name'], data['email'], data['message'])
 
-    slugs = set([x.slug for x in get_blog_posts()])
-    if slug not in slugs:
+    index = await get_post_index(request.app)
+    if index.get(slug) is None:
         raise web.HTTPBadRequest()
     elif any([True for x in (name, email, message) if len(x) > MAX_LEN]):
         raise web.HTTPBadRequest()
 
-    # TODO: maybe some throttle or spam-limit
+    key = comment_key(slug, email, message)
+    if is_duplicate(request.app, key):
+        # answered as if it was stored, e.g. the button clicked twice
+        return web.Response(status=204)
+
+    # the slug is known only from the body, a flood of comments spread
+    # over many clients is stopped here, still before any write
+    check_rate_limit(request.app.post_limiter, slug)
 
-    date = datetime.strftime(datetime.now(), '%Y-%m-%dT%H:%M:%S')
+    date = Timestamp(datetime.strftime(datetime.now(), DATE_FORMAT))
     comment = Comment(
         author=name, date=date, content=message, email=email, post_slug=slug)
-    request.app.db.insert(to_tinydb(comment))
+    insert_comment(request.app, comment)
+    remember_submission(request.app, key)
+    invalidate_comment_pages(request.app, slug)
 
     return web.Response(status=204)
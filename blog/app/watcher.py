@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import ctypes
+import ctypes.util
+import struct
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000  # the watch was removed
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# the watched directory is gone, events of its replacement are not seen
+WATCH_LOST = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, length of name
+
+
+class Inotify(object):
+    """Minimal non-blocking inotify watch of one directory"""
+
+    def __init__(self, path, mask=WATCH_MASK):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is available only on Linux')
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        wd = libc.inotify_add_watch(
+            self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed', path)
+
+    def read(self):
+        """List of (mask, file name) of events which happened"""
+        ret = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return ret
+
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                ret.append((mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PostWatcher(object):
+    """
+    Keeps the post catalog in sync with its directory in the background,
+    so requests never touch the file system to find out about changes.
+    Uses inotify when possible, otherwise scans the directory every
+    `interval` seconds. Only added, changed and removed files are parsed.
+    When the watched directory is removed or moved away, it is watched
+    again at its path, or polled until it can be.
+    """
+
+    DEBOUNCE = 0.1  # editors write files in several steps
+
+    def __init__(self, catalog, *, executor=None, mode='auto', interval=2):
+        self.catalog = catalog
+        self.executor = executor
+        self.mode = mode
+        self.interval = interval
+        self.inotify = None
+        self._task = None
+        self._poller = None
+        self._scheduled = None
+
+    def start(self):
+        if self.mode in ('auto', 'inotify'):
+            try:
+                self._watch()
+            except OSError as ex:
+                if self.mode == 'inotify':
+                    raise
+                logger.warning('Cannot use inotify, polling instead: %s', ex)
+
+        if self.inotify is None:
+            self._start_polling()
+        self.catalog.auto_refresh = False
+
+    def _watch(self):
+        self.inotify = Inotify(self.catalog.path)
+        asyncio.get_event_loop().add_reader(
+            self.inotify.fd, self._on_inotify)
+        logger.info('Watching %s with inotify', self.catalog.path)
+
+    def _unwatch(self):
+        asyncio.get_event_loop().remove_reader(self.inotify.fd)
+        self.inotify.close()
+        self.inotify = None
+
+    def _start_polling(self):
+        self._poller = asyncio.ensure_future(self._poll())
+        logger.info('Polling %s every %ss', self.catalog.path, self.interval)
+
+    def _on_inotify(self):
+        events = self.inotify.read()
+        if any(mask & WATCH_LOST for mask, _ in events):
+            self._rewatch()
+        elif any(mask & IN_Q_OVERFLOW or name.endswith('.md')
+                 for mask, name in events):
+            self._schedule_refresh()
+
+    def _rewatch(self):
+        """Watch the directory which replaced the watched one"""
+        logger.warning('Posts directory %s was replaced', self.catalog.path)
+        self._unwatch()
+        try:
+            self._watch()
+        except OSError as ex:
+            logger.warning('Cannot watch posts again, polling: %s', ex)
+            self._start_polling()
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if self._scheduled is None:
+            loop = asyncio.get_event_loop()
+            self._scheduled = loop.call_later(self.DEBOUNCE, self._refresh)
+
+    def _refresh(self):
+        self._scheduled = None
+        self._task = asyncio.ensure_future(self.refresh())
+
+    async def refresh(self):
+        try:
+            if await self.catalog.refresh_async(self.executor):
+                logger.info('Reloaded posts from %s', self.catalog.path)
+        except Exception:
+            logger.exception('Cannot reload posts')
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.mode != 'poll':
+                # inotify until the watched directory was lost
+                try:
+                    self._watch()
+                except OSError:
+                    pass
+                else:
+                    self._poller = None
+                    await self.refresh()
+                    return
+            await self.refresh()
+
+    async def stop(self):
+        if self.inotify is not None:
+            self._unwatch()
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        for task in (self._poller, self._task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._poller = self._task = None
+
+        self.catalog.auto_refresh = True
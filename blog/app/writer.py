@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+from .app import run_in_executor
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue(object):
+    """
+    Documents waiting to be inserted into the database. A background task
+    writes them with one `insert_multiple` call when `max_batch` documents
+    are queued or `max_delay` seconds after the first one was queued.
+
+    Writes are done in `executor`, which has to run one of them at a time,
+    because the databases are not thread safe; file locks and fsync do not
+    block the event loop. A burst of requests costs one write per batch.
+
+    Every `stats_interval` seconds the depth of the queue, the deepest it
+    was since the previous report and written documents are logged, while
+    there is anything to report.
+    """
+
+    def __init__(self, db, *, max_batch=100, max_delay=0.5,
+                 stats_interval=0, executor=None):
+        self.db = db
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats_interval = stats_interval
+        self.written = 0
+        self.max_depth = 0  # since the previous report
+        self._queue = []
+        self._queued = asyncio.Event()
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._stats_task = None
+
+    @property
+    def depth(self):
+        """Count of documents which are not written yet"""
+        return len(self._queue)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+        if self.stats_interval:
+            self._stats_task = asyncio.ensure_future(self._report())
+
+    def enqueue(self, document):
+        self._queue.append(document)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._queued.set()
+        if len(self._queue) >= self.max_batch:
+            self._full.set()
+
+    async def _run(self):
+        while True:
+            await self._queued.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Cannot write %d documents', self.depth)
+                await asyncio.sleep(self.max_delay)
+
+    async def _report(self):
+        written = 0
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            if self.max_depth or self.written != written:
+                logger.info(
+                    'Write queue depth %d (max %d), %d documents written',
+                    self.depth, self.max_depth, self.written - written)
+            written = self.written
+            self.max_depth = self.depth
+
+    async def flush(self):
+        async with self._lock:
+            while self._queue:
+                batch = self._queue[:self.max_batch]
+                await run_in_executor(
+                    self.executor, self.db.insert_multiple, batch)
+                del self._queue[:len(batch)]
+                self.written += len(batch)
+                logger.debug(
+                    'Written %d documents, %d queued', len(batch), self.depth)
+
+            self._queued.clear()
+            self._full.clear()
+
+    async def close(self):
+        for task in (self._task, self._stats_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._stats_task = None
+
+        await self.flush()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Latency and throughput of request hot paths, reported as JSON.
+
+`executors` compares executors: half of the requests open a post which
+was not rendered yet, the other half hit the index. With `none` executor
+every render blocks the event loop, so index requests wait for it as well.
+
+`paths` scales synthetic archives (posts:comments) and measures `/`,
+`/page/N`, `/post/{slug}` and `POST /comment`. Requests carry
+authorization, so pages are rendered; `--anonymous` measures the page
+cache instead. Runs are seeded, so they can be compared with each other.
+
+    python benchmark.py executors --posts 50 --concurrency 20 none thread
+    python benchmark.py paths --archives 10:0 1000:100 10000:100000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+from aiohttp.test_utils import TestClient, TestServer
+
+
+SRC_ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(SRC_ROOT)
+
+
+from app import create, TestConfig  # noqa
+from app.storage import LogDB  # noqa
+from app.views import Comment, to_tinydb  # noqa
+from tinydb import TinyDB  # noqa
+
+
+def generate_posts(path, count, paragraphs):
+    for i in range(count):
+        lines = [
+            '# Post {}'.format(i), '## Subtitle {}'.format(i),
+            '### 2017-01-01T{:02d}:{:02d}:00'.format(i // 60 % 24, i % 60),
+            '#### post-{}'.format(i), '#####', '###### Benchmark', '#######',
+        ]
+        for j in range(paragraphs):
+            lines.append('## Section {}'.format(j))
+            lines.append('Some *markdown* text with a [link](/) and `code`.')
+            lines.append('* first\n* second\n* third\n')
+        with open(os.path.join(path, 'post-{}.md'.format(i)), 'w') as f:
+            f.write('\n'.join(lines))
+
+
+def generate_comments(db_path, db_backend, posts, count):
+    docs = [to_tinydb(Comment(
+        author='Reader {}'.format(i % 100),
+        date='2017-02-01T{:02d}:{:02d}:00'.format(i // 60 % 24, i % 60),
+        content='Comment number {} with some text.'.format(i),
+        email='reader{}@example.com'.format(i % 100),
+        post_slug='post-{}'.format(i % posts))) for i in range(count)]
+
+    db = LogDB(db_path) if db_backend == 'log' else TinyDB(db_path)
+    if docs:
+        db.insert_multiple(docs)
+    db.close()
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def summary(latencies):
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+async def run(loop, executor, posts_path, posts, concurrency):
+    conf = type('BenchmarkConfig', (TestConfig,), {
+        'posts_path': posts_path, 'executor': executor, 'debug': False})
+    client = TestClient(TestServer(create(loop, conf=conf)), loop=loop)
+    await client.start_server()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {'index': [], 'post': []}
+
+    async def fetch(kind, url):
+        async with semaphore:
+            start = time.perf_counter()
+            resp = await client.get(url)
+            await resp.read()
+            latencies[kind].append(time.perf_counter() - start)
+            assert resp.status == 200, url
+
+    tasks = []
+    for i in range(posts):
+        tasks.append(fetch('post', '/post/post-{}'.format(i)))
+        tasks.append(fetch('index', '/'))
+
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await client.close()
+
+    return {
+        'executor': executor,
+        'requests_per_s': round(len(tasks) / elapsed, 1),
+        'index': summary(latencies['index']),
+        'post': summary(latencies['post']),
+    }
+
+
+async def run_paths(loop, path, posts, comments, args):
+    conf = type('BenchmarkConfig', (TestConfig,), {
+        'posts_path': os.path.join(path, 'posts'), 'memory_db': False,
+        'db_backend': args.db_backend,
+        'log_db_name': os.path.join(path, 'db.jsonl'),
+        'db_name': os.path.join(path, 'db.json'),
+        'executor': args.executor, 'debug': False})
+
+    start = time.perf_counter()
+    client = TestClient(TestServer(create(loop, conf=conf)), loop=loop)
+    await client.start_server()
+    startup = time.perf_counter() - start
+
+    headers = {} if args.anonymous else {'Authorization': 'Token bench'}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = {'index': [], 'page': [], 'post': [], 'comment': []}
+
+    async def fetch(kind, method, url, **kwargs):
+        async with semaphore:
+            start = time.perf_counter()
+            resp = await client.request(
+                method, url, headers=headers, **kwargs)
+            await resp.read()
+            latencies[kind].append(time.perf_counter() - start)
+            assert resp.status in (200, 204), (url, resp.status)
+
+    rand = random.Random(args.seed)
+    total_pages = -(-posts // 5)
+    tasks = []
+    for i in range(args.requests):
+        tasks.append(fetch('index', 'GET', '/'))
+        tasks.append(fetch('page', 'GET', '/page/{}'.format(
+            rand.randint(1, total_pages))))
+        tasks.append(fetch('post', 'GET', '/post/post-{}'.format(
+            rand.randrange(posts))))
+        tasks.append(fetch('comment', 'POST', '/comment', json={
+            'name': 'Bench', 'email': 'bench@example.com',
+            'message': 'Comment {}'.format(i),
+            'post_slug': 'post-{}'.format(rand.randrange(posts)),
+        }))
+    rand.shuffle(tasks)
+
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await client.close()
+
+    return dict({
+        'posts': posts,
+        'comments': comments,
+        'startup_s': round(startup, 3),
+        'requests_per_s': round(len(tasks) / elapsed, 1),
+    }, **{kind: summary(values) for kind, values in latencies.items()})
+
+
+def parse_archive(value):
+    posts, _, comments = value.partition(':')
+    return int(posts), int(comments or 0)
+
+
+def executors(loop, args):
+    results = []
+    for executor in args.executors:
+        with tempfile.TemporaryDirectory() as posts_path:
+            generate_posts(posts_path, args.posts, args.paragraphs)
+            results.append(loop.run_until_complete(run(
+                loop, executor, posts_path, args.posts, args.concurrency)))
+    return results
+
+
+def paths(loop, args):
+    results = []
+    for posts, comments in args.archives:
+        with tempfile.TemporaryDirectory() as path:
+            os.mkdir(os.path.join(path, 'posts'))
+            generate_posts(
+                os.path.join(path, 'posts'), posts, args.paragraphs)
+            db_path = os.path.join(
+                path, 'db.jsonl' if args.db_backend == 'log' else 'db.json')
+            generate_comments(db_path, args.db_backend, posts, comments)
+            results.append(loop.run_until_complete(run_paths(
+                loop, path, posts, comments, args)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    parser_executors = subparsers.add_parser('executors')
+    parser_executors.set_defaults(fun=executors)
+    parser_executors.add_argument(
+        'executors', nargs='*', default=['none', 'thread'])
+    parser_executors.add_argument('--posts', type=int, default=50)
+    parser_executors.add_argument('--paragraphs', type=int, default=300)
+    parser_executors.add_argument('--concurrency', type=int, default=20)
+
+    parser_paths = subparsers.add_parser('paths')
+    parser_paths.set_defaults(fun=paths)
+    parser_paths.add_argument(
+        '--archives', nargs='+', type=parse_archive,
+        default=[(10, 0), (1000, 100), (10000, 100000)],
+        help='posts:comments of generated archives')
+    parser_paths.add_argument(
+        '--requests', type=int, default=200,
+        help='requests of every kind')
+    parser_paths.add_argument('--paragraphs', type=int, default=20)
+    parser_paths.add_argument('--concurrency', type=int, default=20)
+    parser_paths.add_argument('--executor', default='thread')
+    parser_paths.add_argument(
+        '--db-backend', choices=['log', 'tinydb'], default='log')
+    parser_paths.add_argument('--anonymous', action='store_true')
+    parser_paths.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    print(json.dumps(args.fun(loop, args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
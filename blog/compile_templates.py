@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Compile templates ahead of time into python modules, to be used with
+TEMPLATES_COMPILED_PATH:
+
+    python compile_templates.py compiled_templates
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+
+SRC_ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(SRC_ROOT)
+
+
+import jinja2  # noqa
+from app import TEMPLATES_PATH, template_environment  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('target', help='output directory')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    env = template_environment(jinja2.FileSystemLoader(TEMPLATES_PATH))
+    env.compile_templates(
+        args.target, extensions=['jinja2'], zip=None,
+        log_function=logging.info)
+
+
+if __name__ == '__main__':
+    main()
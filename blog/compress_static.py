@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Write gzip and brotli compressed copies next to static files, which are
+served instead of the originals to clients accepting them:
+
+    python compress_static.py [static directory]
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+
+SRC_ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(SRC_ROOT)
+
+
+from app.compression import compress_directory  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        'path', nargs='?', default=os.path.join(SRC_ROOT, 'static'),
+        help='static directory')
+    parser.add_argument(
+        '--min-size', type=int, default=1024,
+        help='smaller files are not compressed')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    written = compress_directory(args.path, args.min_size)
+    logging.info('Written %d compressed files', len(written))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Render all pages of the blog into a directory for a static file server.
+
+Only pages which changed since the previous export are written, and
+pages of removed posts are deleted. Comments are rendered on post pages
+without pagination; POST /comment and /contact still need the application,
+search is left out of exported pages.
+
+    python export.py output --static
+"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp.test_utils import TestClient, TestServer
+
+
+SRC_ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(SRC_ROOT)
+
+
+from app import create, MainConfig, TEMPLATES_PATH  # noqa
+from app.conditional import directory_digest  # noqa
+from app.export import SiteExport, site_urls  # noqa
+
+
+STATIC_PATH = os.path.join(SRC_ROOT, 'static')
+
+
+class ExportConfig(MainConfig):
+    # pages are rendered once, changes of the database are not followed
+    db_read_only = True
+    db_refresh_interval = 0
+    posts_watch = 'off'
+    page_cache_size = 0
+    compress_min_size = 0
+    stream_min_comments = 0
+    # links with query strings do not work on a static file server
+    comments_page_size = 0
+    search_form = False
+
+
+async def run(loop, output, workers):
+    client = TestClient(TestServer(create(loop, conf=ExportConfig)), loop=loop)
+    await client.start_server()
+    try:
+        # entity tags follow static files by their size and mtime only
+        fingerprint = '{}-{}'.format(
+            directory_digest(TEMPLATES_PATH), directory_digest(STATIC_PATH))
+        with ThreadPoolExecutor(workers) as executor:
+            export = SiteExport(
+                client, output, fingerprint=fingerprint, executor=executor,
+                concurrency=workers)
+            urls = await site_urls(client.server.app)
+            written, removed = await export.export(urls)
+    finally:
+        await client.close()
+
+    return len(urls), written, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('output', help='output directory')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument(
+        '--static', action='store_true',
+        help='copy static files into the output directory as well')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    start = time.monotonic()
+    pages, written, removed = loop.run_until_complete(
+        run(loop, args.output, args.workers))
+    if args.static:
+        shutil.copytree(
+            STATIC_PATH, os.path.join(args.output, 'static'),
+            dirs_exist_ok=True)
+
+    logging.info(
+        'Exported %d pages (%d written, %d removed) in %.1fs', pages,
+        written, removed, time.monotonic() - start)
+
+
+if __name__ == '__main__':
+    main()
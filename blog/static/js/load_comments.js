@@ -0,0 +1,40 @@
+// Loading older comments of the post in place
+
+$(function() {
+  $("#olderComments").click(function(event) {
+    event.preventDefault(); // without JS the link opens the next page
+    var $link = $(this);
+    if ($link.hasClass("disabled")) {
+      return;
+    }
+    $link.addClass("disabled");
+
+    $.ajax({
+      url: $link.data("url"),
+      type: "GET",
+      dataType: "json",
+      data: {
+        after: $link.data("cursor")
+      },
+      success: function(data) {
+        $.each(data.comments, function(i, comment) {
+          var $comment = $("<div class='comment'>");
+          $("<p class='author'>").text(comment.author + " ")
+            .append($("<span class='date'>").text("on " + comment.date_formatted))
+            .appendTo($comment);
+          $("<p class='content'>").text(comment.content).appendTo($comment);
+          $comment.append("<hr />").appendTo("#commentsList");
+        });
+
+        if (data.next) {
+          $link.data("cursor", data.next).removeClass("disabled");
+        } else {
+          $link.remove();
+        }
+      },
+      error: function() {
+        $link.removeClass("disabled");
+      }
+    });
+  });
+});